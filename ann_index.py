@@ -0,0 +1,238 @@
+from local_index import LocalVectorIndex
+from time import perf_counter
+import numpy as np
+import argparse
+import json
+import os
+
+
+def assign_nearest(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+
+    # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    assign = np.empty(len(data), dtype=np.int64)
+
+    for start in range(0, len(data), chunk_size):
+        scores = data[start:start + chunk_size] @ centroids.T - half_norms
+        assign[start:start + chunk_size] = np.argmax(scores, axis=1)
+
+    return assign
+
+
+def kmeans(data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0) -> np.ndarray:
+
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = assign_nearest(data, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+
+        nonempty = np.flatnonzero(counts)
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        sums = np.add.reduceat(data[np.argsort(assign, kind="stable")], starts, axis=0)
+
+        empty = counts == 0
+        centroids[nonempty] = sums / counts[nonempty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+
+class IVFPQIndex:
+
+    ARRAYS = ["coarse", "codebooks", "codes", "order", "list_offsets"]
+
+    def __init__(self, nlist: int = 256, m: int = 48, nprobe: int = 16, rerank: int = 64):
+
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.ntotal = 0
+
+
+    def build(self, vectors, train_size: int = 50000, n_iter: int = 20, seed: int = 0):
+
+        vectors = LocalVectorIndex.normalize(vectors)
+        dim = vectors.shape[1]
+        if dim % self.m != 0:
+            raise ValueError(f"Vector dimension {dim} is not divisible by m={self.m}.")
+
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(train_size, len(vectors)), replace=False)]
+
+        self.coarse = kmeans(sample, self.nlist, n_iter=n_iter, seed=seed)
+        self.nlist = len(self.coarse)
+
+        # product quantization of the residuals to the coarse centroid, one 256-entry codebook per subspace
+        dsub = dim // self.m
+        ksub = min(256, len(sample))
+        residuals = sample - self.coarse[assign_nearest(sample, self.coarse)]
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * dsub:(j + 1) * dsub], ksub, n_iter=n_iter, seed=seed + j)
+            for j in range(self.m)
+        ])
+
+        assign = assign_nearest(vectors, self.coarse)
+        residuals = vectors - self.coarse[assign]
+        codes = np.stack([
+            assign_nearest(residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+            for j in range(self.m)
+        ], axis=1).astype(np.uint8)
+
+        self.order = np.argsort(assign, kind="stable")
+        self.codes = codes[self.order]
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.nlist))]).astype(np.int64)
+        self.ntotal = len(vectors)
+
+        return self
+
+
+    def search(self, queries, k: int, nprobe: int = None, rerank: int = None, vectors: np.ndarray = None, allowed: np.ndarray = None) -> list:
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = self.rerank if rerank is None else rerank
+        queries = LocalVectorIndex.normalize(queries)
+        dsub = queries.shape[1] // self.m
+
+        results = []
+        for query in queries:
+            coarse_scores = self.coarse @ query
+            probes = np.argpartition(-coarse_scores, nprobe - 1)[:nprobe]
+
+            # q.(c + r) = q.c + sum_j q_j.r_j, so one lookup table per query serves every probed list
+            table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, dsub))
+
+            spans = [(self.list_offsets[p], self.list_offsets[p + 1]) for p in probes]
+            positions = np.concatenate([np.arange(start, end) for start, end in spans]) if spans else np.zeros(0, dtype=np.int64)
+            if len(positions) == 0:
+                results.append([])
+                continue
+
+            base = np.concatenate([np.full(end - start, coarse_scores[p], dtype=np.float32) for p, (start, end) in zip(probes, spans)])
+            rows = self.order[positions]
+
+            # filtered rows are dropped before their codes are scored, so the shortlist holds only matches
+            if allowed is not None:
+                keep = allowed[rows]
+                positions, base, rows = positions[keep], base[keep], rows[keep]
+                if len(positions) == 0:
+                    results.append([])
+                    continue
+
+            scores = base + table[np.arange(self.m), self.codes[positions]].sum(axis=1)
+
+            shortlist = min(max(k, rerank) if vectors is not None and rerank else k, len(rows))
+            top = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            rows, scores = rows[top], scores[top]
+
+            if vectors is not None and rerank:
+                scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+
+            order = np.argsort(-scores, kind="stable")[:k]
+            results.append([(int(rows[i]), float(scores[i])) for i in order])
+
+        return results
+
+
+    def save(self, path: str):
+
+        os.makedirs(path, exist_ok=True)
+        for name in IVFPQIndex.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+        with open(os.path.join(path, "meta.json"), 'w') as file:
+            json.dump({"nlist": self.nlist, "m": self.m, "nprobe": self.nprobe, "rerank": self.rerank, "ntotal": self.ntotal}, file)
+
+
+    @staticmethod
+    def load(path: str, nprobe: int = None, rerank: int = None) -> "IVFPQIndex":
+
+        with open(os.path.join(path, "meta.json"), 'r') as file:
+            meta = json.load(file)
+
+        index = IVFPQIndex(
+            nlist = meta["nlist"],
+            m = meta["m"],
+            nprobe = nprobe if nprobe is not None else meta["nprobe"],
+            rerank = rerank if rerank is not None else meta["rerank"]
+        )
+        index.ntotal = meta["ntotal"]
+
+        for name in IVFPQIndex.ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+
+        return index
+
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+
+    scores = LocalVectorIndex.normalize(queries) @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def report(vectors: np.ndarray, index: IVFPQIndex, num_queries: int, k: int, nprobes: list, reranks: list, seed: int = 0):
+
+    rng = np.random.default_rng(seed)
+    # queries sit between two corpus chunks so the trivial self-match does not dominate recall
+    pairs = rng.choice(len(vectors), (num_queries, 2))
+    queries = LocalVectorIndex.normalize(vectors[pairs[:, 0]] + vectors[pairs[:, 1]])
+
+    start = perf_counter()
+    truth = exact_search(vectors, queries, k)
+    exact_ms = (perf_counter() - start) / num_queries * 1000
+
+    print(f"{'method':<12}{'nprobe':>8}{'rerank':>8}{f'recall@{k}':>12}{'ms/query':>12}")
+    print(f"{'exact':<12}{'-':>8}{'-':>8}{1.0:>12.3f}{exact_ms:>12.3f}")
+
+    for nprobe in nprobes:
+        for rerank in reranks:
+            start = perf_counter()
+            found = index.search(queries, k, nprobe=nprobe, rerank=rerank, vectors=vectors)
+            elapsed = (perf_counter() - start) / num_queries * 1000
+
+            recall = np.mean([len(truth[i] & {row for row, _ in hits}) / k for i, hits in enumerate(found)])
+            print(f"{'ivfpq':<12}{nprobe:>8}{rerank:>8}{recall:>12.3f}{elapsed:>12.3f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Build an IVF-PQ index for the local backend and report recall@k vs latency against exact search.")
+    parser.add_argument("command", choices = ["build", "report"])
+    parser.add_argument("--json_path", type = str, default = "data/embedded_chunks.json")
+    parser.add_argument("--index_path", type = str, default = "indexes/multi-hop-rag")
+    parser.add_argument("--nlist", type = int, default = 256)
+    parser.add_argument("--m", type = int, default = 48)
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--k", type = int, default = 5)
+    parser.add_argument("--nprobe", type = int, nargs = "+", default = [1, 4, 8, 16, 32])
+    parser.add_argument("--rerank", type = int, nargs = "+", default = [0, 64])
+    args = parser.parse_args()
+
+    ann_path = os.path.join(args.index_path, "ivfpq")
+
+    if args.command == "build":
+        local_index = LocalVectorIndex(args.index_path)
+        start = perf_counter()
+        index = IVFPQIndex(nlist = args.nlist, m = args.m).build(np.asarray(local_index.vectors, dtype=np.float32))
+        index.save(ann_path)
+        print(f"Built IVF-PQ index over {index.ntotal} vectors in {perf_counter() - start:.1f}s -> {ann_path}")
+
+    else:
+        with open(args.json_path, 'r') as file:
+            data = json.load(file)
+
+        vectors = LocalVectorIndex.normalize([item['embeddings'] for item in data if item.get('embeddings') is not None])
+
+        start = perf_counter()
+        index = IVFPQIndex(nlist = args.nlist, m = args.m).build(vectors)
+        print(f"Built IVF-PQ index over {index.ntotal} vectors in {perf_counter() - start:.1f}s")
+
+        report(vectors, index, args.queries, args.k, args.nprobe, args.rerank)
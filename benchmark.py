@@ -1,20 +1,30 @@
-import json 
-import random 
 from nltk.tokenize import word_tokenize
 from omegaconf import DictConfig, OmegaConf
 from graph import create_graph 
 from state import State, Config 
 from tqdm import tqdm
 import hydra
-from time import sleep
+from time import sleep, perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from functools import lru_cache
+from ratelimit import RateLimiter
+from results import ResultWriter, question_hash, config_hash, compare_records, read_records
+from helper import LLM
+from cache import ResponseCache
+from vectorstore import VectorStorePool
+from packing import ContextPacker
+from dataset import LazyDataset
+import tracing
+import offline
 import os 
+import re 
 import nltk 
 from warnings import filterwarnings
 import logging 
 import wandb 
 
 
-nltk.download('punkt_tab')
 filterwarnings("ignore")
 logging.basicConfig(level=logging.ERROR)
 
@@ -30,6 +40,28 @@ slience_list = [
 for logger_name in slience_list:
     logging.getLogger(logger_name).setLevel(logging.ERROR)
 
+logger = logging.getLogger("benchmark")
+logger.setLevel(logging.WARNING)
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(download: bool = True) -> tuple: 
+
+    # offline runs never reach for the network, they use punkt_tab only when it is already installed
+    if download: 
+        nltk.download('punkt_tab')
+
+    try: 
+        word_tokenize("probe")
+        return "punkt_tab", word_tokenize
+
+    except LookupError: 
+        # without network access punkt_tab cannot be fetched; a word/punctuation split stands in for it,
+        # but it splits some tokens differently, so F1 is only comparable between runs with the same tokenizer
+        logger.warning("punkt_tab is unavailable, falling back to a regex tokenizer for F1; scores are not comparable with punkt_tab runs.")
+        return "regex", re.compile(r"\w+|[^\w\s]").findall
+
+
 
 class Benchmark: 
 
@@ -39,8 +71,8 @@ class Benchmark:
         self.data_path = data_path 
         self.config = config 
         
-        with open(data_path, 'r') as file:
-            self.data = json.load(file)
+        self.data = LazyDataset(data_path)
+        self.tokenizer_name, self.tokenize = load_tokenizer(download = not (config.get("offline") or {}).get("enabled", False))
 
     
         self.results = {
@@ -48,6 +80,39 @@ class Benchmark:
             "mean_f1_score": 0.0
         }
 
+        for provider, limits in (self.config.get("rate_limits") or {}).items(): 
+            RateLimiter.configure(
+                provider, 
+                requests_per_minute = limits.get("requests_per_minute"), 
+                tokens_per_minute = limits.get("tokens_per_minute")
+            )
+
+        llm_cache = self.config.get("llm_cache") or {}
+        if llm_cache.get("enabled", False): 
+            LLM.set_response_cache(ResponseCache(
+                path = llm_cache.get("path", "cache/llm_responses.sqlite"), 
+                max_size_mb = llm_cache.get("max_size_mb", 512), 
+                read_only = llm_cache.get("read_only", False)
+            ))
+
+        VectorStorePool.configure(
+            backend = self.config.get("vector_backend", "qdrant"), 
+            index_path = self.config.get("index_path"), 
+            index_dtype = self.config.get("index_dtype", "float32"), 
+            use_ann = (self.config.get("ann") or {}).get("enabled", False), 
+            ann_nprobe = (self.config.get("ann") or {}).get("nprobe"), 
+            ann_rerank = (self.config.get("ann") or {}).get("rerank"), 
+            embedding_cache_path = self.config.get("embedding_cache_path"), 
+            embedding_cache_size = self.config.get("embedding_cache_size", 10000), 
+            retrieval_cache_size = self.config.get("retrieval_cache_size", 10000), 
+            bm25_path = (self.config.get("bm25") or {}).get("path"), 
+            rrf_k = (self.config.get("bm25") or {}).get("rrf_k", 60), 
+            fusion_candidates = (self.config.get("bm25") or {}).get("fusion_candidates", 20)
+        )
+
+        if (self.config.get("offline") or {}).get("enabled", False): 
+            offline.setup(self.config)
+
         self.workflow = create_graph()
         
 
@@ -56,24 +121,22 @@ class Benchmark:
 
 
         if method == "random":
-            sample_size = self.config.get("sample_size", 10)
-            sample_size = min(sample_size, len(self.data))
-            random.seed(self.config.get("seed", 42))
-            return random.sample(self.data, sample_size)
+            return self.data.sample(
+                sample_size = self.config.get("sample_size", 10), 
+                seed = self.config.get("seed", 42)
+            )
 
         elif method == "in_range": 
-            part = self.config.get("part", 0)
-
-            part_item = len(self.data) // self.config.get("num_parts", 1)
-            start = part * part_item  
-            end = start + part_item if part < self.config.get("num_parts", 1) - 1 else len(self.data)
-            return self.data[start:end]
+            return self.data.shard(
+                part = self.config.get("part", 0), 
+                num_parts = self.config.get("num_parts", 1)
+            )
 
 
     def calculate_f1_score(self, ground_truth: str, pred: str): 
 
-        preds_token = set(word_tokenize(pred.lower()))
-        ground_truth_token = set(word_tokenize(ground_truth.lower()))
+        preds_token = set(self.tokenize(pred.lower()))
+        ground_truth_token = set(self.tokenize(ground_truth.lower()))
 
         common_token  = preds_token.intersection(ground_truth_token)
 
@@ -86,10 +149,31 @@ class Benchmark:
 
     def invoke_graph(self, question): 
 
+        early_exit = self.config.get("early_exit") or {}
+        evidence_memory = self.config.get("evidence_memory") or {}
+        packing = self.config.get("packing") or {}
+        rerank = self.config.get("rerank") or {}
+        backbone = self.config.get("backbone", "gemini-2.0-flash")
         state_config = Config(
-            backbone = self.config.get("backbone", "gemini-2.0-flash"),
+            backbone = backbone,
             early_stopping = self.config.get("early_stopping", 3),
-            k = self.config.get("k", 2)
+            k = self.config.get("k", 2),
+            max_concurrency = self.config.get("max_concurrency", 4),
+            batch_retrieval = self.config.get("batch_retrieval", True), 
+            retrieval_mode = self.config.get("retrieval_mode", "dense"), 
+            metadata_filters = self.config.get("metadata_filters", True), 
+            evidence_memory = evidence_memory.get("enabled", True), 
+            dedup_similarity = evidence_memory.get("dedup_similarity", 0.95), 
+            merge_similarity = evidence_memory.get("merge_similarity", 0.85), 
+            rerank = rerank.get("enabled", False), 
+            rerank_model = rerank.get("model", "cross-encoder/ms-marco-MiniLM-L-6-v2"), 
+            rerank_multiplier = rerank.get("multiplier", 4), 
+            context_packing = packing.get("enabled", False), 
+            context_budget = ContextPacker.budget(backbone, packing.get("budgets")), 
+            min_score_ratio = packing.get("min_score_ratio", 0.0), 
+            early_exit = early_exit.get("enabled", False), 
+            min_retrieval_score = early_exit.get("min_retrieval_score", 0.45), 
+            min_novelty = early_exit.get("min_novelty", 0.25)
         )
 
         init_state = State(
@@ -97,96 +181,235 @@ class Benchmark:
             config = state_config,
         )
 
-        output_state = self.workflow.invoke(init_state)
+        if (self.config.get("tracing") or {}).get("enabled", True): 
+            with tracing.trace() as trace: 
+                output_state = self.workflow.invoke(init_state)
+            summary = trace.summary()
+        else: 
+            output_state = self.workflow.invoke(init_state)
+            summary = None 
 
         pred = output_state.get("final_answer", "")
         early_stopping = output_state.get("config").early_stopping
 
         num_iter = self.config.get("early_stopping") - early_stopping
 
-        return pred, num_iter 
+        return pred, num_iter, summary, output_state.get("exit_reason")
 
 
 
-    def save(self, output_path: str, tracking_data: dict = None): 
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    def evaluate(self, item: dict) -> dict: 
 
-        with open(output_path, 'w') as file:
-            json.dump({
-                "metrics": self.results,
-                "config": self.config,
-                "sampled_data": tracking_data
-            }, file, indent=2)
-            
+        query = item.get("query", "")
+        ground_truth = item.get("answer", "")
 
+        pred, num_iter, trace, exit_reason = self.invoke_graph(query)
+        f1_score = self.calculate_f1_score(ground_truth, pred)
+
+        return {
+            "qid": question_hash(item),
+            "config_hash": config_hash(self.config),
+            "query": query,
+            "ground_truth": ground_truth,
+            "prediction": pred,
+            "f1_score": f1_score,
+            "num_iterations": num_iter, 
+            "tokens": tracing.total_tokens(trace), 
+            "prompt_tokens": tracing.total(trace, "prompt_tokens"), 
+            "context_tokens_raw": tracing.total(trace, "context_tokens_raw"), 
+            "context_tokens_packed": tracing.total(trace, "context_tokens_packed"), 
+            "exit_reason": exit_reason, 
+            "trace": trace
+        }
 
     
-    def run_benchmark(self, id: str = "default"):
+    def run_benchmark(self, id: str = "default", on_record = None):
 
         sampled_data = self.sample_data(method=self.config.get("sampling_method", "in_range"))
         part = self.config.get("part", 0)
+        num_workers = self.config.get("num_workers", 1)
+        writer = ResultWriter(
+            output_dir = os.path.join("outputs", id), 
+            id = id, 
+            part = part, 
+            fsync_every = self.config.get("fsync_every", 10), 
+            resume_hash = config_hash(self.config) if self.config.get("resume", True) else None
+        )
+        completed = writer.completed
+        if completed: 
+            print(f"Resuming part {part}: {len(completed)} completed queries found in {writer.records_path}")
+
         tracking_data = []
         num_inst = 0 
-        for item in tqdm(sampled_data): 
-            query = item.get("query", "")
-            ground_truth = item.get("answer", "")
-
-            pred, num_iter = self.invoke_graph(query)
-            f1_score = self.calculate_f1_score(ground_truth, pred)
+        start_time = perf_counter()
+        progress = tqdm(total = len(sampled_data))
 
-            self.results["mean_f1_score"] += f1_score
-            self.results["mean_iter_num"] += num_iter
+        def record(result: dict, resumed: bool = False): 
+            nonlocal num_inst 
 
+            self.results["mean_f1_score"] += result["f1_score"]
+            self.results["mean_iter_num"] += result["num_iterations"]
 
-            tracking_data.append({
-                "query": query,
-                "ground_truth": ground_truth,
-                "prediction": pred,
-                "f1_score": f1_score,
-                "num_iterations": num_iter
-            })
+            tracking_data.append(result)
             num_inst += 1
             wandb.log({
-                "f1_score": f1_score / num_inst,
-                "num_iterations": num_iter,
+                "f1_score": result["f1_score"] / num_inst,
+                "num_iterations": result["num_iterations"],
             })
-            self.save(f"outputs/{id}/results_{id}_part{str(part)}.json", tracking_data)
+            if not resumed: 
+                writer.append(result)
+            if on_record is not None: 
+                on_record(result)
+
+            progress.update(1)
+            progress.set_postfix(qps = f"{num_inst / (perf_counter() - start_time):.3f}")
 
             # sleep(40)
 
+        def run_in_order(executor = None): 
+
+            futures = {}
+            recorded = set()
+            submitted = 0
+            try: 
+                # results are consumed in sample order so the output matches the sequential runner 
+                for position, item in enumerate(sampled_data): 
+                    if executor is not None: 
+                        # at most num_workers questions run ahead of the write position, so a failure wastes little work
+                        for ahead in range(submitted, min(position + num_workers, len(sampled_data))): 
+                            qid = question_hash(sampled_data[ahead])
+                            if qid not in completed and qid not in futures: 
+                                futures[qid] = executor.submit(self.evaluate, sampled_data[ahead])
+                        submitted = max(submitted, position + num_workers)
+
+                    qid = question_hash(item)
+                    if qid in completed: 
+                        record(completed[qid], resumed = True)
+                    elif executor is not None: 
+                        record(futures[qid].result())
+                        recorded.add(qid)
+                    else: 
+                        record(self.evaluate(item))
+
+            except BaseException: 
+                if executor is not None: 
+                    # queued questions are dropped, and the ones that already finished are kept for resume
+                    executor.shutdown(cancel_futures = True)
+                    for qid, future in futures.items(): 
+                        if qid not in recorded and not future.cancelled() and future.exception() is None: 
+                            writer.append(future.result())
+                raise
+
+        with writer: 
+            if num_workers <= 1: 
+                run_in_order()
+
+            else: 
+                with ThreadPoolExecutor(max_workers = num_workers) as executor: 
+                    run_in_order(executor)
+
+        progress.close()
+
 
         self.results["mean_f1_score"] = self.results["mean_f1_score"] / len(sampled_data) if sampled_data else 0.0
+        self.results["f1_tokenizer"] = self.tokenizer_name
         self.results["mean_iter_num"] = self.results["mean_iter_num"] / len(sampled_data) if sampled_data else 0.0
         
         wandb.log({
             "mean_f1_score": self.results["mean_f1_score"],
             "mean_iter_num": self.results["mean_iter_num"],
+            "questions_per_sec": num_inst / (perf_counter() - start_time),
         })
+
+        vectorstore = VectorStorePool.get()
+        embedding_stats = vectorstore.embedding_cache.stats()
+        retrieval_stats = vectorstore.retrieval_cache.stats()
+        print(f"Query embedding cache: {embedding_stats}")
+        print(f"Retrieval result cache: {retrieval_stats}")
+        wandb.log({f"embedding_cache/{key}": value for key, value in embedding_stats.items()})
+        wandb.log({f"retrieval_cache/{key}": value for key, value in retrieval_stats.items()})
+
+        if LLM._response_cache is not None: 
+            cache_stats = LLM._response_cache.stats()
+            print(f"LLM response cache: {cache_stats}")
+            wandb.log({f"llm_cache/{key}": value for key, value in cache_stats.items()})
         
-        self.save(f"outputs/{id}/results_{id}_part{str(part)}.json", tracking_data)
+        latency = tracing.aggregate([result.get("trace") for result in tracking_data])
+        if latency: 
+            print("Per-question latency (s) and per-question counters by span: ")
+            tracing.print_table(latency)
+            writer.write_latency(latency)
+
+            if (self.config.get("tracing") or {}).get("wandb_table", False): 
+                columns = ["span", "count", "mean_s"] + [f"p{q}_s" for q in tracing.PERCENTILES] + tracing.COUNTERS
+                wandb.log({"latency": wandb.Table(
+                    columns = columns, 
+                    data = [[name] + [row.get(column, 0) for column in columns[1:]] for name, row in latency.items()]
+                )})
+
+        exit_reasons = Counter(result.get("exit_reason") for result in tracking_data if result.get("exit_reason"))
+        if exit_reasons: 
+            print(f"Early exits: {dict(exit_reasons)}")
+            self.results["early_exits"] = dict(exit_reasons)
+        self.results["mean_tokens"] = sum(result.get("tokens") or 0 for result in tracking_data) / len(tracking_data) if tracking_data else 0.0
+        self.results["mean_prompt_tokens"] = sum(result.get("prompt_tokens") or 0 for result in tracking_data) / len(tracking_data) if tracking_data else 0.0
+
+        context_raw = sum(result.get("context_tokens_raw") or 0 for result in tracking_data)
+        context_packed = sum(result.get("context_tokens_packed") or 0 for result in tracking_data)
+        if context_packed: 
+            # raw is what the answer prompts would have carried unpacked, packed is what they actually carried
+            self.results["mean_context_tokens_raw"] = context_raw / len(tracking_data)
+            self.results["mean_context_tokens_packed"] = context_packed / len(tracking_data)
+            print(f"Context tokens per question: {context_raw / len(tracking_data):.1f} retrieved -> {context_packed / len(tracking_data):.1f} packed "
+                  f"({1 - context_packed / max(context_raw, 1):.1%} saved), prompt tokens per question: {self.results['mean_prompt_tokens']:.1f}")
+        else: 
+            print(f"Prompt tokens per question: {self.results['mean_prompt_tokens']:.1f}")
+
+        baseline_id = self.config.get("baseline_id")
+        if baseline_id: 
+            baseline_path = os.path.join("outputs", baseline_id, f"results_{baseline_id}_part{part}.jsonl")
+            comparison = compare_records(tracking_data, read_records(baseline_path))
+            if comparison: 
+                print(f"Against baseline '{baseline_id}' on {comparison['num_questions']} shared questions: "
+                      f"f1 {comparison['f1_score_delta']:+.4f}, "
+                      f"iterations saved {comparison['iterations_saved']} ({comparison['num_iterations_delta']:+.3f} per question), "
+                      f"tokens saved {comparison['tokens_saved']} ({comparison['tokens_delta']:+.1f} per question), "
+                      f"prompt tokens {comparison['baseline_prompt_tokens']:.1f} -> {comparison['prompt_tokens']:.1f} per question")
+                self.results["baseline"] = {"id": baseline_id, **comparison}
+                wandb.log({f"baseline/{key}": value for key, value in comparison.items()})
+            else: 
+                print(f"No questions shared with baseline records at {baseline_path}")
+
+        writer.write_summary(self.results, self.config, num_records = len(tracking_data))
+        writer.write_legacy(self.results, self.config, tracking_data)
 
 @hydra.main(config_path = "config", config_name = "default") 
 def run(cfg: DictConfig): 
 
-    wandb.login(
-        key = os.getenv("WANDB_API_KEY")
-    )
-
     config = OmegaConf.to_container(cfg, resolve=True)
+    offline_mode = (config.get("offline") or {}).get("enabled", False)
 
-    wandb.init(
-        project = "MultiHopRAG",
-        name = cfg.id, 
-        config = config, 
+    if offline_mode: 
+        wandb.init(mode = "disabled")
 
-    )
+    else: 
+        wandb.login(
+            key = os.getenv("WANDB_API_KEY")
+        )
+
+        wandb.init(
+            project = "MultiHopRAG",
+            name = cfg.id, 
+            config = config, 
+
+        )
 
     print("Running with config: ") 
     print(OmegaConf.to_yaml(config))
 
     benchmark = Benchmark(
         config = config,
-        data_path = os.path.join("data", "MultiHopRAG.json")
+        data_path = offline.data_path(config) if offline_mode else os.path.join("data", "MultiHopRAG.json")
     )
 
     benchmark.run_benchmark(id=cfg.id)
@@ -0,0 +1,263 @@
+from jsonstream import iter_json_array
+from ingest import point_id, make_payload
+from filters import PayloadIndex
+from time import perf_counter
+from tqdm import tqdm
+import numpy as np
+import threading
+import argparse
+import json
+import re
+import os
+
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is", "it", "its",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with"
+}
+
+
+def tokenize(text: str) -> list:
+
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings: list, k: int, rrf_k: int = 60) -> list:
+
+    # ranks, not raw scores, are fused, so cosine and BM25 scales never need calibrating against each other
+    scores = {}
+    payloads = {}
+    for ranking in rankings:
+        for rank, (pid, _, payload) in enumerate(ranking):
+            scores[pid] = scores.get(pid, 0.0) + 1.0 / (rrf_k + rank + 1)
+            payloads.setdefault(pid, payload)
+
+    order = sorted(scores, key = lambda pid: -scores[pid])
+    return [(pid, scores[pid], payloads[pid]) for pid in order[:k]]
+
+
+
+class BM25Index:
+
+    ARRAYS = ["offsets", "postings", "frequencies", "doc_lengths"]
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.ids = []
+        self.rows = {}
+        self.payloads = []
+        self.payload_index = PayloadIndex()
+        self.dirty = False
+
+        # CSR layout: the postings of term t are postings[offsets[t]:offsets[t + 1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int32)
+        self.frequencies = np.zeros(0, dtype=np.uint16)
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+
+        self._pending = []
+        self._lock = threading.Lock()
+
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+
+    def add(self, ids: list, payloads: list):
+
+        with self._lock:
+            for pid, payload in zip(ids, payloads):
+                pid = str(pid)
+                # ids are content hashes, so a known id is the same chunk again
+                if pid in self.rows:
+                    continue
+
+                tokens = tokenize(f"{payload.get('title', '')} {payload.get('passage', '')}")
+                terms, frequencies = np.unique(
+                    np.asarray([self.vocab.setdefault(token, len(self.vocab)) for token in tokens], dtype=np.int32),
+                    return_counts = True
+                )
+
+                self.rows[pid] = len(self.ids)
+                self.payload_index.add([len(self.ids)], [payload])
+                self.ids.append(pid)
+                self.payloads.append(payload)
+                self._pending.append((terms, np.minimum(frequencies, np.iinfo(np.uint16).max), len(tokens)))
+                self.dirty = True
+
+
+    def _compact(self):
+
+        # pending documents are merged into the CSR arrays in one sort instead of one insert per posting
+        if not self._pending:
+            return
+
+        start = len(self.doc_lengths)
+        old_terms = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+        new_terms = np.concatenate([terms for terms, _, _ in self._pending])
+        new_rows = np.repeat(np.arange(start, start + len(self._pending), dtype=np.int32), [len(terms) for terms, _, _ in self._pending])
+
+        terms = np.concatenate([old_terms, new_terms])
+        rows = np.concatenate([self.postings, new_rows])
+        frequencies = np.concatenate([self.frequencies] + [frequencies.astype(np.uint16) for _, frequencies, _ in self._pending])
+
+        order = np.argsort(terms, kind="stable")
+        self.postings = rows[order]
+        self.frequencies = frequencies[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self.vocab)))]).astype(np.int64)
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray([length for _, _, length in self._pending], dtype=np.int32)])
+        self._pending = []
+
+
+    def search(self, queries: list, k: int, filters: list = None) -> list:
+
+        # a consistent snapshot, since a concurrent add may compact while queries are scored
+        with self._lock:
+            self._compact()
+            offsets, postings, frequencies_all, doc_lengths = self.offsets, self.postings, self.frequencies, self.doc_lengths
+
+        count = len(doc_lengths)
+        if count == 0:
+            return [[] for _ in queries]
+
+        document_frequency = np.diff(offsets)
+        # the length normalisation term depends only on the document, so it is shared by every query term
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / max(doc_lengths.mean(), 1.0))
+
+        results = []
+        for i, query in enumerate(queries):
+            # terms added after the snapshot have no postings in it yet
+            terms = sorted({term for term in map(self.vocab.get, tokenize(query)) if term is not None and term < len(document_frequency)})
+            scores = np.zeros(count, dtype=np.float32)
+
+            for term in terms:
+                rows = postings[offsets[term]:offsets[term + 1]]
+                frequencies = frequencies_all[offsets[term]:offsets[term + 1]].astype(np.float32)
+                df = document_frequency[term]
+                idf = np.log(1.0 + (count - df + 0.5) / (df + 0.5))
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norms[rows])
+
+            if filters is not None and filters[i]:
+                scores[~self.payload_index.mask(filters[i], count)] = 0.0
+
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+
+            order = candidates[np.argsort(-scores[candidates], kind="stable")]
+            results.append([(self.ids[row], float(scores[row]), self.payloads[row]) for row in order])
+
+        return results
+
+
+    def save(self, path: str):
+
+        with self._lock:
+            self._compact()
+
+            os.makedirs(path, exist_ok=True)
+            for name in BM25Index.ARRAYS:
+                np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+
+            terms = sorted(self.vocab, key = self.vocab.get)
+            with open(os.path.join(path, "vocab.txt"), 'w') as file:
+                file.write("".join(f"{term}\n" for term in terms))
+
+            with open(os.path.join(path, "docs.jsonl"), 'w') as file:
+                for pid, payload in zip(self.ids, self.payloads):
+                    file.write(json.dumps({"id": pid, "payload": payload}) + "\n")
+
+            with open(os.path.join(path, "meta.json"), 'w') as file:
+                json.dump({"k1": self.k1, "b": self.b, "count": self.count, "num_terms": len(self.vocab)}, file)
+
+            self.dirty = False
+
+
+    @staticmethod
+    def load(path: str) -> "BM25Index":
+
+        with open(os.path.join(path, "meta.json"), 'r') as file:
+            meta = json.load(file)
+
+        index = BM25Index(k1 = meta["k1"], b = meta["b"])
+        for name in BM25Index.ARRAYS:
+            setattr(index, name, np.load(os.path.join(path, f"{name}.npy")))
+
+        with open(os.path.join(path, "vocab.txt"), 'r') as file:
+            index.vocab = {line.rstrip("\n"): term for term, line in enumerate(file)}
+
+        with open(os.path.join(path, "docs.jsonl"), 'r') as file:
+            for line in file:
+                doc = json.loads(line)
+                index.rows[doc["id"]] = len(index.ids)
+                index.payload_index.add([len(index.ids)], [doc["payload"]])
+                index.ids.append(doc["id"])
+                index.payloads.append(doc["payload"])
+
+        return index
+
+
+    @staticmethod
+    def build(batches) -> "BM25Index":
+
+        index = BM25Index()
+        for ids, payloads in batches:
+            index.add(ids, payloads)
+
+        with index._lock:
+            index._compact()
+
+        return index
+
+
+
+def iter_json_batches(json_path: str, batch_size: int = 1000):
+
+    ids, payloads = [], []
+    for item in iter_json_array(json_path):
+        payload = make_payload(item)
+
+        ids.append(point_id(payload['title'], payload['passage']))
+        payloads.append(payload)
+
+        if len(ids) >= batch_size:
+            yield ids, payloads
+            ids, payloads = [], []
+
+    if ids:
+        yield ids, payloads
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Build or benchmark the BM25 index used by the bm25 and hybrid retrieval modes.")
+    parser.add_argument("command", choices = ["build", "bench"])
+    parser.add_argument("--json_path", type = str, default = "data/embedded_chunks.json")
+    parser.add_argument("--index_path", type = str, default = "indexes/multi-hop-rag/bm25")
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--k", type = int, default = 5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = perf_counter()
+        index = BM25Index.build(tqdm(iter_json_batches(args.json_path), desc="Building BM25 index"))
+        index.save(args.index_path)
+
+        size = sum(getattr(index, name).nbytes for name in BM25Index.ARRAYS)
+        print(f"Indexed {index.count} chunks, {len(index.vocab)} terms, {len(index.postings)} postings ({size / 2**20:.1f} MiB) in {perf_counter() - start:.1f}s -> {args.index_path}")
+
+    else:
+        index = BM25Index.load(args.index_path)
+        rng = np.random.default_rng(0)
+        queries = [index.payloads[row]["title"] for row in rng.choice(index.count, args.queries)]
+
+        start = perf_counter()
+        index.search(queries, args.k)
+        elapsed = (perf_counter() - start) / args.queries
+
+        print(f"{index.count} chunks, k={args.k}: {elapsed * 1000:.3f} ms/query")
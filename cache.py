@@ -0,0 +1,373 @@
+from collections import OrderedDict
+from tracing import annotate
+import numpy as np
+import sqlite3
+import threading
+import hashlib
+import time
+import os
+
+
+class CacheMissError(Exception):
+    pass
+
+
+
+class ResponseCache:
+
+    def __init__(self, path: str = "cache/llm_responses.sqlite", max_size_mb: float = 512, read_only: bool = False):
+
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Replay cache not found at {path}.")
+
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, timeout=30)
+
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self._conn.commit()
+
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+
+    @staticmethod
+    def make_key(model_id: str, temperature: float, prompt: str) -> str:
+
+        content = f"{model_id}\x1f{temperature}\x1f{prompt}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+    def get(self, key: str) -> str:
+
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if not self.read_only:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+
+            return row[0]
+
+
+    def put(self, key: str, response: str):
+
+        if self.read_only:
+            return
+
+        size = len(response.encode("utf-8"))
+
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time())
+            )
+            self._size += size - (row[0] if row else 0)
+
+            if self._size > self.max_size:
+                self._evict()
+
+            self._conn.commit()
+
+
+    def _evict(self):
+
+        # drop least recently used entries until the cache is back under 90% of its budget
+        target = int(self.max_size * 0.9)
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+
+            evicted.append((key,))
+            self._size -= size
+
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "size_bytes": self._size
+        }
+
+
+    def close(self):
+
+        with self._lock:
+            self._conn.close()
+
+
+
+class EmbeddingCache:
+
+    def __init__(self, model_name: str, max_entries: int = 10000, path: str = None):
+
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.miss_latency = 0.0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._conn.commit()
+
+
+    @staticmethod
+    def normalize(text: str) -> str:
+
+        return " ".join(text.lower().split())
+
+
+    def make_key(self, text: str) -> str:
+
+        content = f"{self.model_name}\x1f{EmbeddingCache.normalize(text)}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+    def _remember(self, key: str, vector: np.ndarray):
+
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+    def _lookup(self, key: str) -> np.ndarray:
+
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            return vector
+
+        if self._conn is not None:
+            row = self._conn.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, vector)
+                self.disk_hits += 1
+                return vector
+
+        return None
+
+
+    def _split(self, texts: list) -> tuple:
+
+        keys = [self.make_key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._lookup(key)
+                if vector is not None:
+                    vectors[i] = vector
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+        annotate(cache_hits = len(texts) - sum(len(indices) for indices in missing.values()))
+
+        return vectors, missing
+
+
+    def _fill(self, vectors: list, missing: dict, embeddings: list, elapsed: float) -> list:
+
+        with self._lock:
+            self.misses += len(missing)
+            self.miss_latency += elapsed
+
+            rows = []
+            for (key, indices), embedding in zip(missing.items(), embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+
+                for i in indices:
+                    vectors[i] = vector
+
+            if self._conn is not None:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._conn.commit()
+
+        return [vector.tolist() for vector in vectors]
+
+
+    def embed(self, texts: list, embed_fn) -> list:
+
+        vectors, missing = self._split(texts)
+        if not missing:
+            return [vector.tolist() for vector in vectors]
+
+        start = time.perf_counter()
+        embeddings = embed_fn([texts[indices[0]] for indices in missing.values()])
+
+        return self._fill(vectors, missing, embeddings, time.perf_counter() - start)
+
+
+    async def aembed(self, texts: list, aembed_fn) -> list:
+
+        vectors, missing = self._split(texts)
+        if not missing:
+            return [vector.tolist() for vector in vectors]
+
+        start = time.perf_counter()
+        embeddings = await aembed_fn([texts[indices[0]] for indices in missing.values()])
+
+        return self._fill(vectors, missing, embeddings, time.perf_counter() - start)
+
+
+    def stats(self) -> dict:
+
+        total = self.hits + self.misses
+        mean_miss_latency = self.miss_latency / self.misses if self.misses else 0.0
+
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "mean_miss_latency_s": mean_miss_latency,
+            "latency_saved_s": self.hits * mean_miss_latency
+        }
+
+
+    def close(self):
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+
+class RetrievalCache:
+
+    def __init__(self, max_entries: int = 10000):
+
+        self.max_entries = max_entries
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._payloads = {}
+        self._refs = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def make_key(vector: list, scope: str = "") -> str:
+
+        digest = hashlib.sha256(np.asarray(vector, dtype=np.float32).tobytes())
+        digest.update(scope.encode("utf-8"))
+        return digest.hexdigest()
+
+
+    def get(self, key: str, k: int) -> list:
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            # a cached top-k answers any k' <= k, or any k' when the collection held fewer than k points
+            if entry is None or entry[0] != self.version or (k > entry[2] and len(entry[1]) >= entry[2]):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [(point_id, score, self._payloads[point_id]) for point_id, score in entry[1][:k]]
+
+
+    def put(self, key: str, k: int, results: list, version: int):
+
+        with self._lock:
+            if version != self.version:
+                return
+
+            old = self._entries.get(key)
+            if old is not None and old[2] >= k:
+                return
+
+            self._drop(key)
+            self._entries[key] = (version, [(point_id, score) for point_id, score, _ in results], k)
+
+            for point_id, _, payload in results:
+                self._payloads[point_id] = payload
+                self._refs[point_id] = self._refs.get(point_id, 0) + 1
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+
+    def _drop(self, key: str):
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+
+        for point_id, _ in entry[1]:
+            self._refs[point_id] -= 1
+            if self._refs[point_id] == 0:
+                del self._refs[point_id]
+                del self._payloads[point_id]
+
+
+    def invalidate(self):
+
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._payloads.clear()
+            self._refs.clear()
+
+
+    def stats(self) -> dict:
+
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+            "version": self.version
+        }
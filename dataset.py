@@ -0,0 +1,122 @@
+from jsonstream import iter_json_array_spans
+import numpy as np
+import random
+import json
+import os
+
+
+class DatasetView:
+
+    def __init__(self, dataset: "LazyDataset", indices):
+
+        self.dataset = dataset
+        self.indices = indices
+
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+    def __getitem__(self, i: int) -> dict:
+        return self.dataset[self.indices[i]]
+
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.dataset[index]
+
+
+
+class LazyDataset:
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.index_path = f"{path}.idx.npy"
+        self.index_meta_path = f"{path}.idx.json"
+        self.offsets = self._load_or_build_index()
+        self._fd = os.open(path, os.O_RDONLY)
+
+
+    def _fingerprint(self) -> dict:
+
+        stat = os.stat(self.path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+    def _load_or_build_index(self) -> np.ndarray:
+
+        fingerprint = self._fingerprint()
+
+        if os.path.exists(self.index_path) and os.path.exists(self.index_meta_path):
+            with open(self.index_meta_path, 'r') as file:
+                if json.load(file) == fingerprint:
+                    return np.load(self.index_path, mmap_mode='r')
+
+        spans = self._scan_jsonl() if self.path.endswith(".jsonl") else self._scan_json_array()
+        offsets = np.asarray(spans, dtype=np.uint64).reshape(-1, 2)
+
+        try:
+            np.save(self.index_path, offsets)
+            with open(self.index_meta_path, 'w') as file:
+                json.dump(fingerprint, file)
+        except OSError:
+            # a read-only data directory only costs a rescan on the next start
+            pass
+
+        return offsets
+
+
+    def _scan_jsonl(self) -> list:
+
+        spans = []
+        offset = 0
+        with open(self.path, 'rb') as file:
+            for line in file:
+                if line.strip():
+                    spans.append((offset, len(line)))
+                offset += len(line)
+
+        return spans
+
+
+    def _scan_json_array(self) -> list:
+
+        return [(start, end - start) for start, end in iter_json_array_spans(self.path)]
+
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+    def __getitem__(self, i: int) -> dict:
+
+        offset, length = self.offsets[i]
+        return json.loads(os.pread(self._fd, int(length), int(offset)))
+
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def shard(self, part: int, num_parts: int) -> DatasetView:
+
+        part_item = len(self) // num_parts
+        start = part * part_item
+        end = start + part_item if part < num_parts - 1 else len(self)
+        return DatasetView(self, range(start, end))
+
+
+    def sample(self, sample_size: int, seed: int = 42) -> DatasetView:
+
+        # same draw as random.sample(rows, n) on the fully loaded list, so seeded samples are unchanged
+        random.seed(seed)
+        return DatasetView(self, random.sample(range(len(self)), min(sample_size, len(self))))
+
+
+    def close(self):
+
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
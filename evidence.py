@@ -0,0 +1,95 @@
+from state import State
+from local_index import LocalVectorIndex
+from tracing import annotate
+import numpy as np
+
+
+
+class EvidenceMemory:
+
+    @staticmethod
+    def _past(state: State) -> np.ndarray:
+
+        # embeddings are not serialized, so a restored state has entries without them and matches nothing
+        if not state.evidence or len(state.evidence_embeddings) != len(state.evidence):
+            return None
+
+        return LocalVectorIndex.normalize(state.evidence_embeddings)
+
+
+    @staticmethod
+    def match(state: State, queries: list, embeddings: list) -> dict:
+
+        # i -> ("evidence", index into state.evidence) or ("query", earlier index in this hop)
+        threshold = state.config.dedup_similarity
+        current = LocalVectorIndex.normalize(embeddings)
+        past = EvidenceMemory._past(state)
+
+        matches = {}
+        for i in range(len(queries)):
+            if past is not None:
+                similarities = past @ current[i]
+                best = int(np.argmax(similarities))
+                if similarities[best] >= threshold:
+                    matches[i] = ("evidence", best)
+                    continue
+
+            earlier = [j for j in range(i) if j not in matches]
+            if earlier:
+                similarities = current[earlier] @ current[i]
+                best = int(np.argmax(similarities))
+                if similarities[best] >= threshold:
+                    matches[i] = ("query", earlier[best])
+
+        annotate(reused_answers = len(matches))
+        return matches
+
+
+    @staticmethod
+    def unseen(state: State, embedding: list, docs: list) -> list:
+
+        # a similar but not identical sub-query may ask something else, so its answer is not reused;
+        # only the chunks already read for it are skipped, unless that would leave nothing to read
+        past = EvidenceMemory._past(state)
+        if past is None or not docs:
+            return docs
+
+        query = LocalVectorIndex.normalize(embedding)[0]
+        seen = set()
+        for entry, similarity in zip(state.evidence, past @ query):
+            if similarity >= state.config.merge_similarity:
+                seen.update(entry["ids"])
+
+        remaining = [doc for doc in docs if str(doc.metadata.get("id")) not in seen]
+        return remaining or docs
+
+
+    @staticmethod
+    def assemble(state: State, queries: list, matches: dict, answered: dict) -> list:
+
+        results = []
+        for i, query in enumerate(queries):
+            if i not in matches:
+                results.append(answered[i])
+                continue
+
+            kind, j = matches[i]
+            answer = state.evidence[j]["answer"] if kind == "evidence" else answered[j][0][1]
+            # reused answers carry no documents, so they never count as new evidence for the exit policy
+            results.append(((query, answer), []))
+
+        return results
+
+
+    @staticmethod
+    def record(state: State, queries: list, embeddings: list, answered: dict) -> State:
+
+        for i, ((_, answer), docs) in sorted(answered.items()):
+            state.evidence.append({
+                "query": queries[i],
+                "ids": sorted({str(doc.metadata.get("id")) for doc in docs}),
+                "answer": answer
+            })
+            state.evidence_embeddings.append([float(value) for value in embeddings[i]])
+
+        return state
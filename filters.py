@@ -0,0 +1,213 @@
+from qdrant_client.models import Filter, FieldCondition, MatchText, DatetimeRange
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import threading
+import json
+import re
+
+
+WORD = re.compile(r"\w+")
+
+
+def words(text: str) -> list:
+
+    return WORD.findall(str(text).lower())
+
+
+def parse_date(value) -> datetime:
+
+    if value is None or value == "":
+        return None
+
+    try:
+        parsed = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    # dates without an offset are read as UTC, like the corpus timestamps
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def normalize_published(value) -> str:
+
+    parsed = parse_date(value)
+    return parsed.isoformat() if parsed is not None else None
+
+
+def normalize_filter(raw) -> dict:
+
+    if not isinstance(raw, dict):
+        return None
+
+    result = {}
+
+    sources = raw.get("source")
+    sources = [sources] if isinstance(sources, str) else sources
+    # case is kept for Qdrant's embedded mode, which matches text without an index; every other matcher lowercases
+    sources = sorted({" ".join(str(source).split()) for source in (sources or []) if words(source)})
+    if sources:
+        result["source"] = sources
+
+    if raw.get("title") and words(raw["title"]):
+        result["title"] = " ".join(str(raw["title"]).split())
+
+    for key in ["published_after", "published_before"]:
+        parsed = parse_date(raw.get(key))
+        if parsed is not None:
+            result[key] = parsed.isoformat()
+
+    return result or None
+
+
+def filter_key(filter_dict: dict) -> str:
+
+    return json.dumps(filter_dict, sort_keys=True) if filter_dict else ""
+
+
+def date_bounds(filter_dict: dict) -> tuple:
+
+    # a bare date as the upper bound covers that whole day
+    after = parse_date(filter_dict.get("published_after"))
+    before = parse_date(filter_dict.get("published_before"))
+    if before is not None and before.time() == datetime.min.time():
+        before = before + timedelta(days=1) - timedelta(microseconds=1)
+
+    return after, before
+
+
+def split_queries(items: list) -> tuple:
+
+    queries, filters = [], []
+    for item in items:
+        if isinstance(item, dict):
+            query = item.get("query")
+            if not query:
+                continue
+            queries.append(str(query))
+            filters.append(normalize_filter(item.get("filter")))
+        else:
+            queries.append(str(item))
+            filters.append(None)
+
+    return queries, filters
+
+
+def matches(payload: dict, filter_dict: dict) -> bool:
+
+    if not filter_dict:
+        return True
+
+    if "source" in filter_dict:
+        source = set(words(payload.get("source", "")))
+        if not any(set(words(phrase)) <= source for phrase in filter_dict["source"]):
+            return False
+
+    if "title" in filter_dict and not set(words(filter_dict["title"])) <= set(words(payload.get("title", ""))):
+        return False
+
+    after, before = date_bounds(filter_dict)
+    if after is not None or before is not None:
+        published = parse_date(payload.get("published_at"))
+        if published is None or (after is not None and published < after) or (before is not None and published > before):
+            return False
+
+    return True
+
+
+def to_qdrant(filter_dict: dict) -> Filter:
+
+    if not filter_dict:
+        return None
+
+    must = []
+    if "source" in filter_dict:
+        # full-text conditions on a lowercased word index, so "zee business" matches "Zee Business"
+        sources = [FieldCondition(key = "source", match = MatchText(text = phrase)) for phrase in filter_dict["source"]]
+        must.append(sources[0] if len(sources) == 1 else Filter(should = sources))
+
+    if "title" in filter_dict:
+        must.append(FieldCondition(key = "title", match = MatchText(text = filter_dict["title"])))
+
+    after, before = date_bounds(filter_dict)
+    if after is not None or before is not None:
+        must.append(FieldCondition(key = "published_at", range = DatetimeRange(gte = after, lte = before)))
+
+    return Filter(must = must)
+
+
+
+class PayloadIndex:
+
+    def __init__(self):
+
+        self.count = 0
+        self.source_words = {}
+        self.title_words = {}
+        self.published = np.zeros(1024, dtype=np.float64)
+        self._lock = threading.Lock()
+
+
+    def add(self, rows: list, payloads: list):
+
+        with self._lock:
+            for row, payload in zip(rows, payloads):
+                if row >= len(self.published):
+                    self.published = np.concatenate([self.published, np.zeros(max(row + 1, 2 * len(self.published)) - len(self.published))])
+
+                for field, postings in [("source", self.source_words), ("title", self.title_words)]:
+                    for word in set(words(payload.get(field, ""))):
+                        postings.setdefault(word, set()).add(row)
+
+                published = parse_date(payload.get("published_at"))
+                self.published[row] = published.timestamp() if published is not None else np.nan
+                self.count = max(self.count, row + 1)
+
+
+    @staticmethod
+    def _phrase_rows(postings: dict, phrase: str) -> set:
+
+        rows = None
+        for word in words(phrase):
+            rows = set(postings.get(word, ())) if rows is None else rows & postings.get(word, set())
+            if not rows:
+                return set()
+
+        return rows or set()
+
+
+    def mask(self, filter_dict: dict, count: int) -> np.ndarray:
+
+        allowed = np.ones(count, dtype=bool)
+        if not filter_dict:
+            return allowed
+
+        with self._lock:
+            if "source" in filter_dict:
+                rows = set().union(*[PayloadIndex._phrase_rows(self.source_words, phrase) for phrase in filter_dict["source"]])
+                allowed &= PayloadIndex._row_mask(rows, count)
+
+            if "title" in filter_dict:
+                allowed &= PayloadIndex._row_mask(PayloadIndex._phrase_rows(self.title_words, filter_dict["title"]), count)
+
+            after, before = date_bounds(filter_dict)
+            if after is not None or before is not None:
+                published = np.full(count, np.nan)
+                known = min(count, self.count)
+                published[:known] = self.published[:known]
+                # comparisons with a missing date are False, so undated chunks never pass a date filter
+                with np.errstate(invalid="ignore"):
+                    if after is not None:
+                        allowed &= published >= after.timestamp()
+                    if before is not None:
+                        allowed &= published <= before.timestamp()
+
+        return allowed
+
+
+    @staticmethod
+    def _row_mask(rows: set, count: int) -> np.ndarray:
+
+        mask = np.zeros(count, dtype=bool)
+        rows = [row for row in rows if row < count]
+        mask[rows] = True
+        return mask
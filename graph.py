@@ -5,8 +5,16 @@ from prompt.query_answer import get_query_answer_prompt
 from prompt.query_decompose import get_query_decompose_prompt
 from prompt.answer import get_final_answer_prompt
 from helper import LLM, ReactOutputParse, QueryListOutputParser, AnswerOutputParser
-from vectorstore import VectorStore
+from vectorstore import VectorStorePool
 from time import sleep 
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+from tracing import span, traced, propagate
+from termination import ExitPolicy
+from evidence import EvidenceMemory
+from filters import split_queries
+from packing import ContextPacker, format_document
+from rerank import Reranker
 
 def initialize_node(state: State) -> State: 
 
@@ -16,6 +24,11 @@ def initialize_node(state: State) -> State:
     state.processing_state = ProcessingState.ANALYZE
     state.observation = []
     state.list_queries = []
+    state.query_filters = []
+    state.asked_queries = []
+    state.seen_ids = []
+    state.evidence = []
+    state.evidence_embeddings = []
     
 
     return state
@@ -25,13 +38,9 @@ def initialize_node(state: State) -> State:
 def analyze_node(state: State) -> State: 
 
     prompt  = get_analyze_prompt(state.question, state.observation)
-    llm = LLM.get_backbone_model(state.config.backbone)
-
-    chain = llm | ReactOutputParse()
-
     try : 
         # sleep(5) 
-        response = chain.invoke(prompt)
+        response = LLM.invoke_chain(state.config.backbone, ReactOutputParse, prompt)
         state.react_output = response 
         
 
@@ -47,50 +56,115 @@ def query_decompose_node(state: State) -> State:
     
     state.config.early_stopping -= 1
     prompt = get_query_decompose_prompt(state.question, state.react_output.analysis)
-    llm = LLM.get_backbone_model(state.config.backbone)
-
-    chain = llm | QueryListOutputParser()
-
     try : 
         # sleep(5) 
-        response = chain.invoke(prompt)
-        state.list_queries = response
+        response = LLM.invoke_chain(state.config.backbone, QueryListOutputParser, prompt)
+        state.list_queries, state.query_filters = split_queries(response)
 
         if not state.list_queries:
             raise ValueError("No queries generated from the decomposition step.")
 
         state.processing_state = ProcessingState.RAG
 
-        return state
+        return ExitPolicy.filter_queries(state)
     except Exception as e:
         raise ValueError(f"Error during query decomposition: {e}")
     
 
 
+def answer_query(query: str, k: int, backbone: str, docs: list = None, budget: int = None, min_score_ratio: float = 0.0) -> tuple:
+
+    try: 
+        if docs is None: 
+            vectorstore = VectorStorePool.get()
+            docs = vectorstore.similarity_search(query, k = k)
+
+        if budget is not None: 
+            docs = ContextPacker.pack(query, docs, backbone, budget, min_score_ratio)
+
+        formatted_docs = [format_document(doc) for doc in docs]
+        
+        prompt = get_query_answer_prompt(
+            query = query, 
+            information = formatted_docs,
+        )
+        # sleep(5) 
+        with span("answer_query"): 
+            response = LLM.invoke_chain(backbone, AnswerOutputParser, prompt)
+
+        return (query, response)
+    
+    except Exception as e:
+        raise ValueError(f"Error during RAG process for query '{query}': {e}")
+
+
+
 def rag_node(state: State) -> State:
 
-    vectorstore = VectorStore()
+    queries = state.list_queries
+    # states built without decomposition (or before filters existed) carry no aligned filter list
+    filters = state.query_filters if state.config.metadata_filters and len(state.query_filters) == len(queries) else [None] * len(queries)
+    vectorstore = VectorStorePool.get()
 
-    for query in state.list_queries:
+    # only modes that search dense vectors embed up front; the vectors are passed on to the search
+    embeddings, matches = None, {}
+    if state.config.evidence_memory and state.config.retrieval_mode != "bm25" and queries: 
+        with span("embed"): 
+            embeddings = vectorstore.embed_queries(queries)
+        matches = EvidenceMemory.match(state, queries, embeddings)
+
+    pending = [i for i in range(len(queries)) if i not in matches]
+    max_workers = max(1, min(state.config.max_concurrency, len(pending)))
+    # with reranking on, k * rerank_multiplier candidates are fetched and the cross-encoder keeps the top k
+    fetch_k = state.config.k * state.config.rerank_multiplier if state.config.rerank else state.config.k
+
+    if state.config.batch_retrieval and pending: 
         try: 
-            docs = vectorstore.similarity_search(query, k = state.config.k)
-            formatted_docs = [f"Title: {doc.metadata.get('title', '')}\n Passage: {doc.page_content}" for doc in docs]
-            
-            prompt = get_query_answer_prompt(
-                query = query, 
-                information = formatted_docs,
+            docs_list = vectorstore.batch_similarity_search(
+                [queries[i] for i in pending], 
+                k = fetch_k, 
+                mode = state.config.retrieval_mode, 
+                filters = [filters[i] for i in pending], 
+                embeddings = [embeddings[i] for i in pending] if embeddings is not None else None
             )
-            llm = LLM.get_backbone_model(state.config.backbone)
 
-            chain = llm | AnswerOutputParser()    
-            # sleep(5) 
-            response = chain.invoke(prompt)
+            if state.config.rerank: 
+                docs_list = Reranker.rerank([queries[i] for i in pending], docs_list, state.config.k, state.config.rerank_model)
 
-            state.observation.append((query, response))
-            state.processing_state = ProcessingState.ANALYZE
-        
         except Exception as e:
-            raise ValueError(f"Error during RAG process for query '{query}': {e}")
+            raise ValueError(f"Error during batched retrieval for queries {queries}: {e}")
+
+    else: 
+        docs_list = [None] * len(pending)
+
+    def retrieve_and_answer(i, docs): 
+        # the documents are kept so the exit policy can score the hop
+        if docs is None: 
+            docs = vectorstore.similarity_search(queries[i], k = fetch_k, filter_dict = filters[i], mode = state.config.retrieval_mode, embedding = embeddings[i] if embeddings is not None else None)
+            if state.config.rerank: 
+                docs = Reranker.rerank([queries[i]], [docs], state.config.k, state.config.rerank_model)[0]
+
+        unseen = EvidenceMemory.unseen(state, embeddings[i], docs) if embeddings is not None else docs
+
+        return answer_query(queries[i], state.config.k, state.config.backbone, unseen, *ContextPacker.settings(state.config)), docs
+
+    if max_workers == 1: 
+        answered = [retrieve_and_answer(i, docs) for i, docs in zip(pending, docs_list)]
+
+    else: 
+        with ThreadPoolExecutor(max_workers = max_workers) as executor: 
+            answered = list(executor.map(propagate(retrieve_and_answer), pending, docs_list))
+
+    answered = dict(zip(pending, answered))
+    results = EvidenceMemory.assemble(state, queries, matches, answered)
+    if embeddings is not None: 
+        EvidenceMemory.record(state, queries, embeddings, answered)
+
+    observations = [observation for observation, _ in results]
+    ExitPolicy.assess(state, [docs for _, docs in results], observations)
+
+    state.observation.extend(observations)
+    state.processing_state = ProcessingState.ANALYZE
 
     return state
 
@@ -104,13 +178,9 @@ def generate_answer_node(state: State) -> State:
         observation=state.observation
     ) 
 
-    llm = LLM.get_backbone_model(state.config.backbone)
-
-    chain = llm | AnswerOutputParser()
-
     try:
         # sleep(5) 
-        response = chain.invoke(prompt)
+        response = LLM.invoke_chain(state.config.backbone, AnswerOutputParser, prompt)
         
         state.final_answer = response
 
@@ -120,6 +190,145 @@ def generate_answer_node(state: State) -> State:
     return state
 
 
+async def aanalyze_node(state: State) -> State: 
+
+    prompt  = get_analyze_prompt(state.question, state.observation)
+    try : 
+        state.react_output = await LLM.ainvoke_chain(state.config.backbone, ReactOutputParse, prompt)
+
+        return state
+
+    except Exception as e:
+        raise ValueError(f"Error during analysis: {e}")
+
+
+
+async def aquery_decompose_node(state: State) -> State:
+
+    state.config.early_stopping -= 1
+    prompt = get_query_decompose_prompt(state.question, state.react_output.analysis)
+    try : 
+        state.list_queries, state.query_filters = split_queries(await LLM.ainvoke_chain(state.config.backbone, QueryListOutputParser, prompt))
+
+        if not state.list_queries:
+            raise ValueError("No queries generated from the decomposition step.")
+
+        state.processing_state = ProcessingState.RAG
+
+        return ExitPolicy.filter_queries(state)
+    except Exception as e:
+        raise ValueError(f"Error during query decomposition: {e}")
+
+
+
+async def aanswer_query(query: str, k: int, backbone: str, docs: list = None, budget: int = None, min_score_ratio: float = 0.0) -> tuple:
+
+    try: 
+        if docs is None: 
+            vectorstore = await VectorStorePool.aget()
+            docs = (await vectorstore.abatch_similarity_search([query], k = k))[0]
+
+        if budget is not None: 
+            docs = ContextPacker.pack(query, docs, backbone, budget, min_score_ratio)
+
+        formatted_docs = [format_document(doc) for doc in docs]
+
+        prompt = get_query_answer_prompt(
+            query = query, 
+            information = formatted_docs,
+        )
+        with span("answer_query"): 
+            response = await LLM.ainvoke_chain(backbone, AnswerOutputParser, prompt)
+
+        return (query, response)
+
+    except Exception as e:
+        raise ValueError(f"Error during RAG process for query '{query}': {e}")
+
+
+
+async def arag_node(state: State) -> State:
+
+    queries = state.list_queries
+    # states built without decomposition (or before filters existed) carry no aligned filter list
+    filters = state.query_filters if state.config.metadata_filters and len(state.query_filters) == len(queries) else [None] * len(queries)
+    vectorstore = await VectorStorePool.aget()
+
+    embeddings, matches = None, {}
+    if state.config.evidence_memory and state.config.retrieval_mode != "bm25" and queries: 
+        with span("embed"): 
+            embeddings = await vectorstore.aembed_queries(queries)
+        matches = EvidenceMemory.match(state, queries, embeddings)
+
+    pending = [i for i in range(len(queries)) if i not in matches]
+    fetch_k = state.config.k * state.config.rerank_multiplier if state.config.rerank else state.config.k
+
+    if state.config.batch_retrieval and pending: 
+        try: 
+            docs_list = await vectorstore.abatch_similarity_search(
+                [queries[i] for i in pending], 
+                k = fetch_k, 
+                mode = state.config.retrieval_mode, 
+                filters = [filters[i] for i in pending], 
+                embeddings = [embeddings[i] for i in pending] if embeddings is not None else None
+            )
+
+            if state.config.rerank: 
+                # the forward pass is CPU-bound, so it runs off the event loop
+                docs_list = await asyncio.to_thread(Reranker.rerank, [queries[i] for i in pending], docs_list, state.config.k, state.config.rerank_model)
+
+        except Exception as e:
+            raise ValueError(f"Error during batched retrieval for queries {queries}: {e}")
+
+    else: 
+        docs_list = [None] * len(pending)
+
+    # same per-question fan-out bound as the threaded node, without a thread per sub-query
+    semaphore = asyncio.Semaphore(max(1, state.config.max_concurrency))
+
+    async def bounded(i, docs): 
+        async with semaphore: 
+            if docs is None: 
+                docs = (await vectorstore.abatch_similarity_search([queries[i]], k = fetch_k, filter_dict = filters[i], mode = state.config.retrieval_mode, embeddings = [embeddings[i]] if embeddings is not None else None))[0]
+                if state.config.rerank: 
+                    docs = (await asyncio.to_thread(Reranker.rerank, [queries[i]], [docs], state.config.k, state.config.rerank_model))[0]
+
+            unseen = EvidenceMemory.unseen(state, embeddings[i], docs) if embeddings is not None else docs
+
+            return await aanswer_query(queries[i], state.config.k, state.config.backbone, unseen, *ContextPacker.settings(state.config)), docs
+
+    answered = dict(zip(pending, await asyncio.gather(*[bounded(i, docs) for i, docs in zip(pending, docs_list)])))
+    results = EvidenceMemory.assemble(state, queries, matches, answered)
+    if embeddings is not None: 
+        EvidenceMemory.record(state, queries, embeddings, answered)
+
+    observations = [observation for observation, _ in results]
+    ExitPolicy.assess(state, [docs for _, docs in results], observations)
+
+    state.observation.extend(observations)
+    state.processing_state = ProcessingState.ANALYZE
+
+    return state
+
+
+
+async def agenerate_answer_node(state: State) -> State:
+
+    prompt = get_final_answer_prompt(
+        question=state.question, 
+        analysis=state.react_output.analysis, 
+        observation=state.observation
+    ) 
+
+    try:
+        state.final_answer = await LLM.ainvoke_chain(state.config.backbone, AnswerOutputParser, prompt)
+
+    except Exception as e:
+        raise ValueError(f"Error during final answer generation: {e}")
+
+    return state
+
+
 def router(state: State) -> str:
 
     if state.react_output.action == Action.RETRIEVE and state.config.early_stopping <= 0:
@@ -139,15 +348,25 @@ def router(state: State) -> str:
     raise ValueError(f"Invalid action: {state.react_output.action}. Expected 'query_decompose' or 'generate_answer'.")
 
 
-def create_graph(): 
+def decompose_router(state: State) -> str:
+
+    return ExitPolicy.route(state, "rag")
+
+
+def rag_router(state: State) -> str:
+
+    return ExitPolicy.route(state, "analyze")
+
+
+def create_graph(use_async: bool = False): 
 
     workflow = StateGraph(State)
 
     workflow.add_node("initialize", initialize_node)
-    workflow.add_node("analyze", analyze_node)
-    workflow.add_node("query_decompose", query_decompose_node)
-    workflow.add_node("rag", rag_node)
-    workflow.add_node("generate_answer", generate_answer_node)
+    workflow.add_node("analyze", traced("analyze", aanalyze_node if use_async else analyze_node))
+    workflow.add_node("query_decompose", traced("query_decompose", aquery_decompose_node if use_async else query_decompose_node))
+    workflow.add_node("rag", traced("rag", arag_node if use_async else rag_node))
+    workflow.add_node("generate_answer", traced("generate_answer", agenerate_answer_node if use_async else generate_answer_node))
 
     workflow.set_entry_point("initialize")
     workflow.add_edge("initialize", "analyze")
@@ -161,8 +380,22 @@ def create_graph():
 
     )
 
-    workflow.add_edge("query_decompose", "rag")
-    workflow.add_edge("rag", "analyze")
+    workflow.add_conditional_edges(
+        "query_decompose", 
+        decompose_router, 
+        {
+            "rag": "rag",
+            "generate_answer": "generate_answer"
+        }
+    )
+    workflow.add_conditional_edges(
+        "rag", 
+        rag_router, 
+        {
+            "analyze": "analyze",
+            "generate_answer": "generate_answer"
+        }
+    )
 
     workflow.add_edge("generate_answer", END)
 
@@ -170,4 +403,11 @@ def create_graph():
 
 
 
+def create_async_graph(): 
+
+    return create_graph(use_async = True)
+
+
+
 graph = create_graph()
+async_graph = create_async_graph()
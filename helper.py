@@ -5,8 +5,14 @@ from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_groq import ChatGroq 
 from langchain_core.output_parsers import BaseOutputParser
 from state import ReactOutput, Action
+from ratelimit import RateLimiter, call_with_backoff, acall_with_backoff, estimate_tokens
+from cache import ResponseCache, CacheMissError
+from tracing import annotate, record_usage, arecord_usage
+from langchain_core.runnables import RunnableLambda
 import json 
 import re 
+import threading 
+import httpx 
 
 load_dotenv('.env', override = True)
 
@@ -17,22 +23,226 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 class LLM : 
 
+    _models = {}
+    _chains = {}
+    _lock = threading.Lock()
+    _http_client = None 
+    _async_http_client = None 
+    _fake_model = None 
+    _response_cache = None 
+
+    max_retries = 5
 
-    @staticmethod 
-    def get_backbone_model(model_name: str, temperature: float = 0.3):
+
+    @staticmethod
+    def get_provider(model_name: str) -> str:
 
         if "gemini" in model_name.lower():
-            return LLM.get_gemini_model(model_name=model_name, temperature=temperature)
+            return "gemini"
         
         elif "gpt" in model_name.lower():
-            return LLM.get_gpt_model(model_name=model_name, temperature=temperature)
+            return "openai"
 
         elif "llama" in model_name.lower() or "deepseek" in model_name.lower():
-            return LLM.get_groq_model(model_name=model_name, temperature=temperature)
+            return "groq"
 
         raise ValueError(f"Unsupported model name: {model_name}. Supported models are Gemini, GPT, and Groq.")
 
 
+    @staticmethod 
+    def get_backbone_model(model_name: str, temperature: float = 0.3, max_token: int = None):
+
+        if LLM._fake_model is not None: 
+            return LLM._fake_model
+
+        provider = LLM.get_provider(model_name)
+        key = (provider, model_name, temperature, max_token)
+
+        with LLM._lock: 
+            model = LLM._models.get(key)
+
+            if model is None: 
+                kwargs = {"model_name": model_name, "temperature": temperature}
+                if max_token is not None: 
+                    kwargs["max_token"] = max_token
+
+                if provider == "gemini":
+                    model = LLM.get_gemini_model(**kwargs)
+                elif provider == "openai":
+                    model = LLM.get_gpt_model(**kwargs)
+                else: 
+                    model = LLM.get_groq_model(**kwargs)
+
+                LLM._models[key] = model 
+
+        return model 
+
+
+    @staticmethod 
+    def get_chain(model_name: str, parser_cls: type, temperature: float = 0.3, max_token: int = None):
+
+        llm = LLM.get_backbone_model(model_name, temperature = temperature, max_token = max_token)
+        key = (id(llm), parser_cls)
+
+        with LLM._lock: 
+            chain = LLM._chains.get(key)
+
+            if chain is None: 
+                # usage metadata is read off the message before the parser drops it
+                chain = llm | RunnableLambda(record_usage, afunc = arecord_usage) | parser_cls()
+                LLM._chains[key] = chain 
+
+        return chain 
+
+
+    @staticmethod 
+    def get_model_id(model_name: str) -> str: 
+
+        if LLM._fake_model is not None: 
+            return f"fake:{type(LLM._fake_model).__name__}"
+
+        return model_name
+
+
+    @staticmethod 
+    def invoke_chain(model_name: str, parser_cls: type, prompt: str, temperature: float = 0.3): 
+
+        limiter = RateLimiter.get(LLM.get_provider(model_name))
+        cache = LLM._response_cache
+
+        if cache is None: 
+            chain = LLM.get_chain(model_name, parser_cls, temperature = temperature)
+
+            def call(): 
+                if limiter is not None: 
+                    limiter.acquire(estimate_tokens(prompt))
+
+                return chain.invoke(prompt)
+
+            return call_with_backoff(call, max_retries = LLM.max_retries)
+
+        key = ResponseCache.make_key(LLM.get_model_id(model_name), temperature, prompt)
+        text = cache.get(key)
+
+        if text is not None: 
+            annotate(cache_hits = 1)
+            return parser_cls().parse(text)
+
+        if cache.read_only: 
+            raise CacheMissError(f"No cached response for {model_name} in replay mode.")
+
+        llm = LLM.get_backbone_model(model_name, temperature = temperature)
+
+        def call(): 
+            if limiter is not None: 
+                limiter.acquire(estimate_tokens(prompt))
+
+            return record_usage(llm.invoke(prompt)).content
+
+        text = call_with_backoff(call, max_retries = LLM.max_retries)
+        response = parser_cls().parse(text)
+        cache.put(key, text)
+
+        return response 
+
+
+    @staticmethod 
+    async def ainvoke_chain(model_name: str, parser_cls: type, prompt: str, temperature: float = 0.3): 
+
+        limiter = RateLimiter.get(LLM.get_provider(model_name))
+        cache = LLM._response_cache
+
+        if cache is None: 
+            chain = LLM.get_chain(model_name, parser_cls, temperature = temperature)
+
+            async def call(): 
+                if limiter is not None: 
+                    await limiter.aacquire(estimate_tokens(prompt))
+
+                return await chain.ainvoke(prompt)
+
+            return await acall_with_backoff(call, max_retries = LLM.max_retries)
+
+        key = ResponseCache.make_key(LLM.get_model_id(model_name), temperature, prompt)
+        text = cache.get(key)
+
+        if text is not None: 
+            annotate(cache_hits = 1)
+            return parser_cls().parse(text)
+
+        if cache.read_only: 
+            raise CacheMissError(f"No cached response for {model_name} in replay mode.")
+
+        llm = LLM.get_backbone_model(model_name, temperature = temperature)
+
+        async def call(): 
+            if limiter is not None: 
+                await limiter.aacquire(estimate_tokens(prompt))
+
+            return record_usage(await llm.ainvoke(prompt)).content
+
+        text = await acall_with_backoff(call, max_retries = LLM.max_retries)
+        response = parser_cls().parse(text)
+        cache.put(key, text)
+
+        return response 
+
+
+    @staticmethod 
+    def set_response_cache(cache: ResponseCache): 
+
+        LLM._response_cache = cache 
+
+
+    @staticmethod 
+    def set_fake_model(model): 
+
+        with LLM._lock: 
+            LLM._fake_model = model 
+            LLM._chains.clear()
+
+
+    @staticmethod 
+    def clear_cache(): 
+
+        with LLM._lock: 
+            LLM._models.clear()
+            LLM._chains.clear()
+            LLM._fake_model = None 
+
+
+    @staticmethod 
+    def get_http_client() -> httpx.Client: 
+
+        if LLM._http_client is None: 
+            LLM._http_client = httpx.Client(
+                limits = httpx.Limits(
+                    max_connections = 100, 
+                    max_keepalive_connections = 20, 
+                    keepalive_expiry = 30.0
+                ), 
+                timeout = httpx.Timeout(60.0)
+            )
+
+        return LLM._http_client
+
+
+    @staticmethod 
+    def get_async_http_client() -> httpx.AsyncClient: 
+
+        if LLM._async_http_client is None: 
+            LLM._async_http_client = httpx.AsyncClient(
+                limits = httpx.Limits(
+                    max_connections = 200, 
+                    max_keepalive_connections = 50, 
+                    keepalive_expiry = 30.0
+                ), 
+                timeout = httpx.Timeout(60.0)
+            )
+
+        return LLM._async_http_client
+
+
     @staticmethod 
     def get_gemini_model(model_name: str = "gemini-2.0-flash", max_token : int = 100, temperature: float = 0.3) -> ChatGoogleGenerativeAI:
 
@@ -51,7 +261,9 @@ class LLM :
             model = model_name,
             max_tokens = max_token,
             temperature = temperature,
-            openai_api_key = GPT_API_KEY
+            openai_api_key = GPT_API_KEY, 
+            http_client = LLM.get_http_client(), 
+            http_async_client = LLM.get_async_http_client()
         ) 
         
 
@@ -62,7 +274,9 @@ class LLM :
             model = model_name,
             max_tokens = max_token,
             temperature = temperature,
-            api_key = GROQ_API_KEY
+            api_key = GROQ_API_KEY, 
+            http_client = LLM.get_http_client(), 
+            http_async_client = LLM.get_async_http_client()
         ) 
         
 
@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from jsonstream import iter_json_array
+from time import perf_counter
+from tqdm import tqdm
+from filters import normalize_published
+import threading
+import uuid
+
+
+def point_id(title: str, passage: str) -> str:
+
+    # content-addressed ids make re-ingestion overwrite points instead of duplicating them
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{title}\n{passage}"))
+
+
+def make_payload(item: dict) -> dict:
+
+    payload = {'title': item.get('title', 'No Title'), 'passage': item.get('passage', 'No Passage')}
+
+    # the filterable fields are kept only when the corpus has them, so older chunk files load unchanged
+    if item.get('source'):
+        payload['source'] = item['source']
+    if normalize_published(item.get('published_at')) is not None:
+        payload['published_at'] = normalize_published(item.get('published_at'))
+
+    return payload
+
+
+def iter_batches(items, batch_size: int):
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+
+class StageTimer:
+
+    def __init__(self):
+
+        self.docs = 0
+        self.busy = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+
+    def record(self, num_docs: int, started_at: float, finished_at: float):
+
+        with self._lock:
+            self.docs += num_docs
+            self.busy += finished_at - started_at
+            self.started_at = started_at if self.started_at is None else min(self.started_at, started_at)
+            self.finished_at = finished_at if self.finished_at is None else max(self.finished_at, finished_at)
+
+
+    def stats(self) -> dict:
+
+        wall = (self.finished_at - self.started_at) if self.docs else 0.0
+        return {
+            "docs": self.docs,
+            "wall_s": wall,
+            "busy_s": self.busy,
+            "docs_per_sec": self.docs / wall if wall else 0.0,
+            "docs_per_busy_sec": self.docs / self.busy if self.busy else 0.0
+        }
+
+
+
+class IngestionPipeline:
+
+    def __init__(self, store, batch_size: int = 100, embed_workers: int = 4, upsert_workers: int = 2, max_in_flight: int = 8, reuse_embeddings: bool = True):
+
+        self.store = store
+        self.dim = getattr(store.backend, "dim", 768)
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.max_in_flight = max_in_flight
+        self.reuse_embeddings = reuse_embeddings
+        self.timers = {stage: StageTimer() for stage in ["read", "embed", "upsert"]}
+
+
+    def _read(self, json_path: str):
+
+        items = iter_json_array(json_path)
+        done = object()
+
+        while True:
+            started_at = perf_counter()
+            item = next(items, done)
+            if item is done:
+                return
+
+            payload = make_payload(item)
+            embedding = item.get('embeddings', None) if self.reuse_embeddings else None
+
+            record = {
+                "id": point_id(payload['title'], payload['passage']),
+                "text": f"{payload['title']}\n{payload['passage']}",
+                "vector": embedding if embedding is not None and len(embedding) == self.dim else None,
+                "payload": payload
+            }
+            self.timers["read"].record(1, started_at, perf_counter())
+
+            yield record
+
+
+    def _embed(self, batch: list) -> list:
+
+        missing = [record for record in batch if record["vector"] is None]
+
+        if missing:
+            started_at = perf_counter()
+            vectors = self.store.embedding_model.embed_documents([record["text"] for record in missing])
+            self.timers["embed"].record(len(missing), started_at, perf_counter())
+
+            for record, vector in zip(missing, vectors):
+                record["vector"] = vector
+
+        return batch
+
+
+    def _upsert(self, batch: list) -> int:
+
+        started_at = perf_counter()
+        self.store.upsert(
+            [record["id"] for record in batch],
+            [record["vector"] for record in batch],
+            [record["payload"] for record in batch]
+        )
+        self.timers["upsert"].record(len(batch), started_at, perf_counter())
+
+        return len(batch)
+
+
+    def run(self, json_path: str) -> dict:
+
+        num_docs = 0
+        embedding = deque()
+        upserting = deque()
+        progress = tqdm(desc = "Loading documents", unit = "doc")
+
+        def drain_upserts(limit: int):
+            nonlocal num_docs
+            while len(upserting) > limit:
+                count = upserting.popleft().result()
+                num_docs += count
+                progress.update(count)
+
+        def drain_embeddings(limit: int):
+            while len(embedding) > limit:
+                batch = embedding.popleft().result()
+                upserting.append(upsert_pool.submit(self._upsert, batch))
+                drain_upserts(self.max_in_flight)
+
+        start = perf_counter()
+        with ThreadPoolExecutor(max_workers = self.embed_workers) as embed_pool, ThreadPoolExecutor(max_workers = self.upsert_workers) as upsert_pool:
+            for batch in iter_batches(self._read(json_path), self.batch_size):
+                embedding.append(embed_pool.submit(self._embed, batch))
+                drain_embeddings(self.max_in_flight)
+
+            drain_embeddings(0)
+            drain_upserts(0)
+
+        progress.close()
+        elapsed = perf_counter() - start
+
+        return {
+            "documents": num_docs,
+            "wall_s": elapsed,
+            "docs_per_sec": num_docs / elapsed if elapsed else 0.0,
+            "stages": {stage: timer.stats() for stage, timer in self.timers.items()}
+        }
@@ -0,0 +1,87 @@
+import mmap
+import json
+import re
+import os
+
+
+TOKEN = re.compile(rb'["\[\]{},]|\S')
+STRUCTURAL = re.compile(rb'["\[\]{},]')
+NESTED = re.compile(rb'["\[\]{}]')
+STRING_END = re.compile(rb'(?:[^"\\]|\\.)*"', re.S)
+NON_SPACE = re.compile(rb'\S')
+
+
+def iter_json_array_spans(path: str):
+
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"{path} is empty.")
+
+        # the file is scanned through a read-only map, so memory stays flat whatever its size
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            match = NON_SPACE.search(data, 0)
+            if match is None or match.group() != b'[':
+                raise ValueError(f"{path} does not contain a JSON array.")
+
+            pos = match.end()
+            depth = 1
+            start = None
+
+            while True:
+                if depth > 1:
+                    pattern = NESTED
+                else:
+                    pattern = TOKEN if start is None else STRUCTURAL
+
+                match = pattern.search(data, pos)
+                if match is None:
+                    raise ValueError(f"Unexpected end of JSON array in {path}.")
+
+                char = match.group()
+                pos = match.end()
+
+                if char == b'"':
+                    if depth == 1 and start is None:
+                        start = match.start()
+
+                    end = STRING_END.match(data, pos)
+                    if end is None:
+                        raise ValueError(f"Unterminated string in {path} at byte {match.start()}.")
+                    pos = end.end()
+
+                    if depth == 1:
+                        yield start, pos
+                        start = None
+
+                elif char in b'[{':
+                    if depth == 1 and start is None:
+                        start = match.start()
+                    depth += 1
+
+                elif char in b']}':
+                    depth -= 1
+
+                    if depth == 0:
+                        if start is not None:
+                            yield start, match.start()
+                        return
+
+                    if depth == 1:
+                        yield start, pos
+                        start = None
+
+                elif char == b',':
+                    if depth == 1 and start is not None:
+                        yield start, match.start()
+                        start = None
+
+                elif depth == 1 and start is None:
+                    start = match.start()
+
+
+def iter_json_array(path: str):
+
+    with open(path, 'rb') as file:
+        for start, end in iter_json_array_spans(path):
+            file.seek(start)
+            yield json.loads(file.read(end - start))
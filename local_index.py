@@ -0,0 +1,278 @@
+from time import perf_counter
+from tqdm import tqdm
+from jsonstream import iter_json_array
+from ingest import point_id, make_payload
+import numpy as np
+import threading
+import argparse
+import json
+import os
+
+
+class LocalVectorIndex:
+
+    CHUNK_ROWS = 1024
+
+    def __init__(self, path: str, dim: int = 768, dtype: str = "float32"):
+
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.offsets_path = os.path.join(path, "offsets.bin")
+        self.payloads_path = os.path.join(path, "payloads.jsonl")
+        self.ids_path = os.path.join(path, "ids.txt")
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as file:
+                meta = json.load(file)
+
+            self.dim = meta["dim"]
+            self.dtype = np.dtype(meta["dtype"])
+            self.count = meta["count"]
+
+        else:
+            self.dim = dim
+            self.dtype = np.dtype(dtype)
+            self.count = 0
+
+            for file_path in [self.vectors_path, self.offsets_path, self.payloads_path, self.ids_path]:
+                open(file_path, 'wb').close()
+            self._write_meta()
+
+        with open(self.ids_path, 'r') as file:
+            self.ids = [line.rstrip("\n") for line in file][:self.count]
+        self.rows = {pid: row for row, pid in enumerate(self.ids)}
+
+        self._payload_fd = os.open(self.payloads_path, os.O_RDONLY)
+        self._map()
+
+
+    def _write_meta(self):
+
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({"dim": self.dim, "dtype": self.dtype.name, "count": self.count}, file)
+
+        os.replace(tmp_path, self.meta_path)
+
+
+    def _map(self):
+
+        # read-only maps share the page cache, so worker processes reuse the same physical pages
+        if self.count:
+            self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(self.count, self.dim))
+            self.offsets = np.memmap(self.offsets_path, dtype=np.uint64, mode='r', shape=(self.count, 2))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self.offsets = np.zeros((0, 2), dtype=np.uint64)
+
+
+    @staticmethod
+    def normalize(vectors) -> np.ndarray:
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+    def add(self, ids: list, vectors: list, payloads: list):
+
+        vectors = LocalVectorIndex.normalize(vectors).astype(self.dtype)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim vectors, got {vectors.shape[1]}.")
+
+        with self._lock:
+            payload_end = os.path.getsize(self.payloads_path)
+            updates = []
+            new_ids, new_vectors, new_offsets = [], [], []
+
+            with open(self.payloads_path, 'ab') as payload_file:
+                for pid, vector, payload in zip(ids, vectors, payloads):
+                    line = (json.dumps(payload) + "\n").encode("utf-8")
+                    payload_file.write(line)
+                    offset = (payload_end, len(line))
+                    payload_end += len(line)
+
+                    pid = str(pid)
+                    row = self.rows.get(pid)
+                    if row is not None and row >= self.count:
+                        new_vectors[row - self.count] = vector
+                        new_offsets[row - self.count] = offset
+                    elif row is not None:
+                        updates.append((row, vector, offset))
+                    else:
+                        self.rows[pid] = self.count + len(new_ids)
+                        new_ids.append(pid)
+                        new_vectors.append(vector)
+                        new_offsets.append(offset)
+
+            if updates:
+                vector_map = np.memmap(self.vectors_path, dtype=self.dtype, mode='r+', shape=(self.count, self.dim))
+                offset_map = np.memmap(self.offsets_path, dtype=np.uint64, mode='r+', shape=(self.count, 2))
+                for row, vector, offset in updates:
+                    vector_map[row] = vector
+                    offset_map[row] = offset
+
+                vector_map.flush()
+                offset_map.flush()
+                del vector_map, offset_map
+
+            if new_ids:
+                with open(self.vectors_path, 'ab') as file:
+                    file.write(np.asarray(new_vectors, dtype=self.dtype).tobytes())
+
+                with open(self.offsets_path, 'ab') as file:
+                    file.write(np.asarray(new_offsets, dtype=np.uint64).tobytes())
+
+                with open(self.ids_path, 'a') as file:
+                    file.write("".join(f"{pid}\n" for pid in new_ids))
+
+                self.ids.extend(new_ids)
+                self.count += len(new_ids)
+                self._write_meta()
+
+            self._map()
+
+
+    def payload(self, row: int) -> dict:
+
+        offset, length = self.offsets[row]
+        return json.loads(os.pread(self._payload_fd, int(length), int(offset)))
+
+
+    def search(self, queries, k: int, start: int = 0, allowed: np.ndarray = None) -> list:
+
+        vectors = self.vectors[start:]
+        rows = None
+        if allowed is not None:
+            # only the rows passing the filter are read from the map and scored
+            rows = np.flatnonzero(allowed[start:self.count])
+        count = len(vectors) if rows is None else len(rows)
+
+        if count == 0:
+            return [[] for _ in range(len(queries))]
+
+        k = min(k, count)
+        queries = LocalVectorIndex.normalize(queries)
+        if self.dtype != np.float32:
+            return self._search_chunked(queries, vectors, rows, k, start)
+
+        if rows is not None:
+            vectors = vectors[rows]
+        scores = queries @ vectors.T
+
+        if k < count:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(count), (len(queries), 1))
+
+        results = []
+        for row_scores, candidates in zip(scores, top):
+            order = candidates[np.argsort(-row_scores[candidates], kind="stable")]
+            results.append([(int(row if rows is None else rows[row]) + start, float(row_scores[row])) for row in order])
+
+        return results
+
+
+    def _search_chunked(self, queries: np.ndarray, vectors: np.ndarray, rows: np.ndarray, k: int, start: int) -> list:
+
+        # half-precision maps are cast one chunk at a time into a reused buffer, never as a whole float32 copy
+        count = len(vectors) if rows is None else len(rows)
+        buffer = np.empty((min(LocalVectorIndex.CHUNK_ROWS, count), self.dim), dtype=np.float32)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+        for chunk_start in range(0, count, LocalVectorIndex.CHUNK_ROWS):
+            positions = np.arange(chunk_start, min(chunk_start + LocalVectorIndex.CHUNK_ROWS, count))
+            if rows is not None:
+                positions = rows[positions]
+                chunk = vectors[positions]
+            else:
+                chunk = vectors[positions[0]:positions[-1] + 1]
+
+            np.copyto(buffer[:len(positions)], chunk)
+            scores = np.concatenate([best_scores, queries @ buffer[:len(positions)].T], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(positions, (len(queries), len(positions)))], axis=1)
+
+            # a running top-k per query, so memory stays at one chunk whatever the index size
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                candidates = np.take_along_axis(candidates, top, axis=1)
+            best_scores, best_rows = scores, candidates
+
+        results = []
+        for row_scores, candidates in zip(best_scores, best_rows):
+            order = np.lexsort((candidates, -row_scores))
+            results.append([(int(candidates[i]) + start, float(row_scores[i])) for i in order])
+
+        return results
+
+
+    def close(self):
+
+        with self._lock:
+            if self._payload_fd is not None:
+                os.close(self._payload_fd)
+                self._payload_fd = None
+
+
+
+def build_from_json(json_path: str, index_path: str, dtype: str = "float32", batch_size: int = 1000) -> LocalVectorIndex:
+
+    index = LocalVectorIndex(index_path, dtype=dtype)
+    ids, vectors, payloads = [], [], []
+
+    for item in tqdm(iter_json_array(json_path), desc="Building local index"):
+        embedding = item.get('embeddings', None)
+        if embedding is None or len(embedding) != index.dim:
+            continue
+
+        payload = make_payload(item)
+
+        ids.append(point_id(payload['title'], payload['passage']))
+        vectors.append(embedding)
+        payloads.append(payload)
+
+        if len(ids) >= batch_size:
+            index.add(ids, vectors, payloads)
+            ids, vectors, payloads = [], [], []
+
+    if ids:
+        index.add(ids, vectors, payloads)
+
+    return index
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Build or benchmark the memory-mapped local vector index.")
+    parser.add_argument("command", choices = ["build", "bench"])
+    parser.add_argument("--json_path", type = str, default = "data/embedded_chunks.json")
+    parser.add_argument("--index_path", type = str, default = "indexes/multi-hop-rag")
+    parser.add_argument("--dtype", type = str, default = "float32", choices = ["float32", "float16"])
+    parser.add_argument("--queries", type = int, default = 200)
+    parser.add_argument("--k", type = int, default = 5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = build_from_json(args.json_path, args.index_path, dtype = args.dtype)
+        print(f"Indexed {index.count} vectors into {args.index_path}")
+
+    else:
+        index = LocalVectorIndex(args.index_path)
+        queries = np.random.default_rng(0).standard_normal((args.queries, index.dim)).astype(np.float32)
+
+        start = perf_counter()
+        for query in queries:
+            index.search(query, args.k)
+        elapsed = (perf_counter() - start) / args.queries
+
+        print(f"{index.count} vectors ({index.dtype.name}), k={args.k}: {elapsed * 1000:.3f} ms/query")
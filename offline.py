@@ -0,0 +1,245 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from prompt.analyze import ANALYZE_PROMPT
+from prompt.query_decompose import QUERY_DECOMPOSE_PROMPT
+from prompt.query_answer import QUERY_ANSWER_PROMPT
+from prompt.answer import FINAL_ANSWER_PROMPT
+from ratelimit import RateLimiter, estimate_tokens
+from helper import LLM
+from rerank import Reranker
+from vectorstore import VectorStorePool
+from collections import Counter
+import numpy as np
+import hashlib
+import asyncio
+import random
+import time
+import json
+import re
+import os
+
+
+OFFLINE_DIR = os.path.join("cache", "offline")
+WORD = re.compile(r"\w+")
+
+
+def _section(prompt: str, name: str) -> str:
+
+    # the filled-in values follow the last marker, the earlier ones belong to the few-shot examples
+    start = prompt.rfind(f"[{name}]:")
+    if start < 0:
+        return ""
+
+    text = prompt[start + len(name) + 3:]
+    end = re.search(r"\n\s*\[[A-Z]+\]:|\nfinal_answer =|\nOutput:|\nGenerate the output", text)
+    return (text[:end.start()] if end else text).strip().strip('"')
+
+
+
+class ScriptedChatModel(BaseChatModel):
+
+    hops: int = 2
+    num_queries: int = 2
+    latency_s: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+
+    def respond(self, prompt: str) -> str:
+
+        # every reply is a pure function of the prompt, so runs and cache replays are reproducible
+        if prompt.startswith(ANALYZE_PROMPT[:80]):
+            hop = _section(prompt, "OBSERVATION").count("- (") // max(1, self.num_queries)
+
+            if hop >= self.hops:
+                return json.dumps({"action": "ANSWER", "analysis": f"hop {hop}: the observations cover every part of the question."})
+            return json.dumps({"action": "RETRIEVE", "analysis": f"hop {hop}: more evidence is needed."})
+
+        if prompt.startswith(QUERY_DECOMPOSE_PROMPT[:80]):
+            question = _section(prompt, "QUESTION")
+            hop = _section(prompt, "ANALYSIS").split(":")[0]
+            return json.dumps({"queries": [f"{question} ({hop}, part {i + 1})" for i in range(self.num_queries)]})
+
+        if prompt.startswith(QUERY_ANSWER_PROMPT[:80]):
+            # the closing entity of the top chunk, which for the synthetic corpus is the partner company
+            match = re.search(r"chunk_1: (.*?)(?:\nchunk_2:|\n\s*Output:)", prompt[prompt.rfind("[INFORMATION]:"):], re.S)
+            words = WORD.findall(match.group(1)) if match else []
+            return json.dumps({"query": _section(prompt, "QUERY"), "answer": words[-1] if words else "No information available."})
+
+        if prompt.startswith(FINAL_ANSWER_PROMPT[:80]):
+            answers = re.findall(r'^- \(.*, "(.*)"\)$', _section(prompt, "OBSERVATION"), re.M)
+            return json.dumps({"answer": Counter(answers).most_common(1)[0][0] if answers else "Insufficient information."})
+
+        raise ValueError(f"ScriptedChatModel has no script for prompt: {prompt[:80]}")
+
+
+    def _result(self, messages) -> ChatResult:
+
+        prompt = messages[-1].content
+        content = self.respond(prompt)
+        message = AIMessage(
+            content = content,
+            usage_metadata = {
+                "input_tokens": estimate_tokens(prompt),
+                "output_tokens": estimate_tokens(content),
+                "total_tokens": estimate_tokens(prompt) + estimate_tokens(content)
+            }
+        )
+
+        return ChatResult(generations = [ChatGeneration(message = message)])
+
+
+    def _generate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+        return self._result(messages)
+
+
+    async def _agenerate(self, messages, stop = None, run_manager = None, **kwargs) -> ChatResult:
+
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+
+        return self._result(messages)
+
+
+
+class HashingEmbeddings(Embeddings):
+
+    def __init__(self, dim: int = 768):
+
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+
+    def _embed(self, text: str) -> list:
+
+        # signed feature hashing of words and word bigrams, stable across processes unlike hash()
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = WORD.findall(text.lower())
+
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+
+    def embed_query(self, text: str) -> list:
+        return self._embed(text)
+
+
+    async def aembed_documents(self, texts: list) -> list:
+        return self.embed_documents(texts)
+
+
+    async def aembed_query(self, text: str) -> list:
+        return self.embed_query(text)
+
+
+
+class OverlapCrossEncoder:
+
+    # stands in for the sentence-transformers CrossEncoder: the score is the share of query words found in the passage
+    def predict(self, pairs: list, batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+
+        scores = []
+        for query, passage in pairs:
+            query_words = set(WORD.findall(query.lower()))
+            scores.append(len(query_words & set(WORD.findall(passage.lower()))) / max(len(query_words), 1))
+
+        return np.asarray(scores, dtype=np.float32)
+
+
+
+def synthetic_dataset(num_docs: int = 1000, num_questions: int = 60, seed: int = 0, output_dir: str = OFFLINE_DIR) -> tuple:
+
+    corpus_path = os.path.join(output_dir, f"corpus_{num_docs}_{seed}.json")
+    questions_path = os.path.join(output_dir, f"questions_{num_docs}_{num_questions}_{seed}.json")
+    if os.path.exists(corpus_path) and os.path.exists(questions_path):
+        return corpus_path, questions_path
+
+    rng = random.Random(seed)
+    cities = [f"City{i}" for i in range(max(4, num_docs // 20))]
+    people = [f"Person{i}" for i in range(max(4, num_docs // 10))]
+
+    corpus = []
+    for i in range(num_docs):
+        corpus.append({
+            "title": f"Company{i}",
+            "passage": f"Company{i} is headquartered in {rng.choice(cities)}. It was founded by {rng.choice(people)} and partners with Company{rng.randrange(num_docs)}."
+        })
+
+    questions = []
+    for i in range(num_questions):
+        doc = corpus[rng.randrange(num_docs)]
+        partner = doc["passage"].rsplit(" ", 1)[-1].rstrip(".")
+        questions.append({
+            "query": f"Where is the partner of {doc['title']} headquartered, and who founded {doc['title']}?",
+            "answer": partner
+        })
+
+    os.makedirs(output_dir, exist_ok=True)
+    for path, data in [(corpus_path, corpus), (questions_path, questions)]:
+        with open(path, 'w') as file:
+            json.dump(data, file)
+
+    return corpus_path, questions_path
+
+
+def data_path(config: dict) -> str:
+
+    offline = config.get("offline") or {}
+    if offline.get("data_path"):
+        return offline["data_path"]
+
+    return synthetic_dataset(
+        num_docs = offline.get("num_docs", 1000),
+        num_questions = offline.get("num_questions", 60),
+        seed = offline.get("seed", 0)
+    )[1]
+
+
+def setup(config: dict):
+
+    offline = config.get("offline") or {}
+
+    # provider quotas would only throttle the scripted model
+    RateLimiter.reset()
+    LLM.set_fake_model(ScriptedChatModel(
+        hops = offline.get("hops", 2),
+        num_queries = offline.get("num_queries", 2),
+        latency_s = offline.get("latency_ms", 0) / 1000
+    ))
+    Reranker.set_fake_model(OverlapCrossEncoder())
+
+    VectorStorePool.configure(
+        backend = "memory",
+        embedding_model = HashingEmbeddings(dim = offline.get("embedding_dim", 768)),
+        embedding_cache_path = None
+    )
+
+    corpus_path = offline.get("corpus_path") or synthetic_dataset(
+        num_docs = offline.get("num_docs", 1000),
+        num_questions = offline.get("num_questions", 60),
+        seed = offline.get("seed", 0)
+    )[0]
+
+    store = VectorStorePool.get()
+    if store.backend.count == 0:
+        # stored embeddings come from a different model, so the corpus is re-embedded with the hashing one;
+        # a single upsert worker keeps row order, and with it tie-breaking between equal scores, fixed across runs
+        store.load_documents_from_json(corpus_path, upsert_workers = 1, reuse_embeddings = False)
+
+    return store
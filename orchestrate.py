@@ -0,0 +1,270 @@
+from omegaconf import DictConfig, OmegaConf
+from benchmark import Benchmark, load_tokenizer
+from dataset import LazyDataset
+from results import write_json_atomic, compare_records
+import tracing
+import offline
+from collections import deque
+from time import perf_counter
+from tqdm import tqdm
+import multiprocessing as mp
+import queue as queue_lib
+import hydra
+import wandb
+import json
+import os
+
+
+def run_shard(config: dict, id: str, part: int, data_path: str, queue):
+
+    # every worker owns its graph, LLM clients and vector store; only finished records cross the process boundary
+    wandb.init(mode = "disabled")
+
+    try:
+        benchmark = Benchmark(config = dict(config, part = part, sampling_method = "in_range"), data_path = data_path)
+        benchmark.run_benchmark(id = id, on_record = lambda record: queue.put(("record", part, record)))
+        queue.put(("done", part, benchmark.results))
+
+    except Exception as e:
+        queue.put(("error", part, f"{type(e).__name__}: {e}"))
+        raise
+
+
+def shard_config(config: dict, num_processes: int) -> dict:
+
+    # provider quotas are shared by all workers, so each one gets its slice of the budget
+    rate_limits = {}
+    for provider, limits in (config.get("rate_limits") or {}).items():
+        rate_limits[provider] = {
+            key: max(1, value // num_processes) if value else value
+            for key, value in limits.items()
+        }
+
+    return dict(config, rate_limits = rate_limits)
+
+
+
+class ShardOrchestrator:
+
+    def __init__(self, config: dict, data_path: str):
+
+        self.config = config
+        self.data_path = data_path
+        self.num_parts = config.get("num_parts", 1)
+        self.num_processes = max(1, min(config.get("num_processes", self.num_parts), self.num_parts))
+        self.max_retries = config.get("max_shard_retries", 2)
+        self.context = mp.get_context(config.get("start_method", "spawn"))
+
+        self.records = {part: {} for part in range(self.num_parts)}
+        self.attempts = {part: 0 for part in range(self.num_parts)}
+        self.status = {part: "pending" for part in range(self.num_parts)}
+        self.total_f1 = 0.0
+        self.total_iter = 0.0
+
+
+    def _add_record(self, part: int, record: dict):
+
+        # a retried shard replays its checkpoint, so records are keyed by qid and never counted twice
+        previous = self.records[part].get(record["qid"])
+        if previous is not None:
+            self.total_f1 -= previous["f1_score"]
+            self.total_iter -= previous["num_iterations"]
+
+        self.records[part][record["qid"]] = record
+        self.total_f1 += record["f1_score"]
+        self.total_iter += record["num_iterations"]
+
+        return previous is None
+
+
+    def _num_records(self) -> int:
+        return sum(len(records) for records in self.records.values())
+
+
+    def _start(self, part: int, id: str, queue):
+
+        self.attempts[part] += 1
+        self.status[part] = "running"
+        process = self.context.Process(
+            target = run_shard,
+            args = (shard_config(self.config, self.num_processes), id, part, self.data_path, queue),
+            name = f"shard-{part}"
+        )
+        process.start()
+
+        return process
+
+
+    def run(self, id: str = "default") -> dict:
+
+        data = LazyDataset(self.data_path)
+        total = len(data)
+        data.close()
+
+        queue = self.context.Queue()
+        pending = deque(range(self.num_parts))
+        running = {}
+        errors = {}
+
+        start_time = perf_counter()
+        progress = tqdm(total = total, desc = f"{self.num_parts} shards")
+
+        def handle(message):
+
+            kind, part, payload = message
+
+            if kind == "record":
+                if self._add_record(part, payload):
+                    progress.update(1)
+
+                num_records = self._num_records()
+                progress.set_postfix(
+                    mean_f1 = f"{self.total_f1 / num_records:.3f}",
+                    qps = f"{num_records / (perf_counter() - start_time):.3f}"
+                )
+                wandb.log({
+                    "f1_score": self.total_f1 / num_records,
+                    "num_iterations": payload["num_iterations"],
+                    f"shard_{part}/num_records": len(self.records[part])
+                })
+
+            elif kind == "done":
+                self.status[part] = "done"
+
+            elif kind == "error":
+                errors[part] = payload
+
+        def drain():
+            while True:
+                try:
+                    handle(queue.get_nowait())
+                except queue_lib.Empty:
+                    return
+
+        while pending or running:
+
+            while pending and len(running) < self.num_processes:
+                part = pending.popleft()
+                running[part] = self._start(part, id, queue)
+
+            try:
+                handle(queue.get(timeout = 1.0))
+            except queue_lib.Empty:
+                pass
+
+            for part, process in list(running.items()):
+                if process.is_alive():
+                    continue
+
+                process.join()
+                # a finished worker has flushed its queue, so its last messages are readable now
+                drain()
+                del running[part]
+
+                if process.exitcode == 0 and self.status[part] == "done":
+                    continue
+
+                reason = errors.pop(part, f"exit code {process.exitcode}")
+                if self.attempts[part] <= self.max_retries:
+                    print(f"Shard {part} failed ({reason}), re-queuing from its checkpoint (attempt {self.attempts[part] + 1})")
+                    self.status[part] = "pending"
+                    pending.append(part)
+                else:
+                    print(f"Shard {part} failed ({reason}) after {self.attempts[part]} attempts, giving up")
+                    self.status[part] = "failed"
+
+        progress.close()
+        drain()
+
+        return self.write_report(id, perf_counter() - start_time)
+
+
+    def write_report(self, id: str, elapsed: float) -> dict:
+
+        num_records = self._num_records()
+        all_records = [record for part in range(self.num_parts) for record in self.records[part].values()]
+
+        # means over all records, so uneven shards weigh in by their size instead of one vote each
+        metrics = {
+            "mean_f1_score": self.total_f1 / num_records if num_records else 0.0,
+            "f1_tokenizer": load_tokenizer(download = not (self.config.get("offline") or {}).get("enabled", False))[0],
+            "mean_iter_num": self.total_iter / num_records if num_records else 0.0,
+            "mean_tokens": sum(record.get("tokens") or 0 for record in all_records) / num_records if num_records else 0.0,
+            "mean_prompt_tokens": sum(record.get("prompt_tokens") or 0 for record in all_records) / num_records if num_records else 0.0,
+            "questions_per_sec": num_records / elapsed if elapsed else 0.0
+        }
+
+        baseline_id = self.config.get("baseline_id")
+        if baseline_id: 
+            baseline_path = os.path.join("outputs", baseline_id, f"results_{baseline_id}_merged.json")
+            if os.path.exists(baseline_path): 
+                with open(baseline_path, 'r') as file: 
+                    comparison = compare_records(all_records, json.load(file).get("sampled_data", []))
+                metrics.update({f"baseline/{key}": value for key, value in comparison.items()})
+            else: 
+                print(f"Baseline report not found at {baseline_path}")
+
+        shards = {}
+        for part, records in self.records.items():
+            shards[part] = {
+                "status": self.status[part],
+                "attempts": self.attempts[part],
+                "num_records": len(records),
+                "mean_f1_score": sum(record["f1_score"] for record in records.values()) / len(records) if records else 0.0,
+                "mean_iter_num": sum(record["num_iterations"] for record in records.values()) / len(records) if records else 0.0
+            }
+
+        wandb.log(metrics)
+
+        report_path = os.path.join("outputs", id, f"results_{id}_merged.json")
+        write_json_atomic(report_path, {
+            "metrics": metrics,
+            "config": self.config,
+            "num_records": num_records,
+            "shards": shards,
+            "latency": tracing.aggregate([record.get("trace") for record in all_records]),
+            "failed_shards": [part for part, status in self.status.items() if status != "done"],
+            "sampled_data": all_records
+        }, indent=2)
+
+        print(f"Merged {num_records} records from {self.num_parts} shards into {report_path}: {metrics}")
+
+        return metrics
+
+
+@hydra.main(config_path = "config", config_name = "default")
+def run(cfg: DictConfig):
+
+    config = OmegaConf.to_container(cfg, resolve=True)
+    offline_mode = (config.get("offline") or {}).get("enabled", False)
+
+    if offline_mode:
+        wandb.init(mode = "disabled")
+
+    else:
+        wandb.login(
+            key = os.getenv("WANDB_API_KEY")
+        )
+
+        wandb.init(
+            project = "MultiHopRAG",
+            name = f"{cfg.id}-merged",
+            config = config,
+        )
+
+    print("Running with config: ")
+    print(OmegaConf.to_yaml(config))
+
+    orchestrator = ShardOrchestrator(
+        config = config,
+        data_path = offline.data_path(config) if offline_mode else os.path.join("data", "MultiHopRAG.json")
+    )
+
+    orchestrator.run(id=cfg.id)
+    wandb.finish()
+
+    print("Done!")
+
+
+if __name__ == "__main__":
+    run()
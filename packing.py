@@ -0,0 +1,130 @@
+from langchain.schema import Document
+from ratelimit import estimate_tokens
+from tracing import annotate
+from bm25 import tokenize
+from omegaconf import OmegaConf
+from functools import lru_cache
+import re
+import os
+
+
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "default.yaml")
+MIN_TOKENS = 16
+
+
+@lru_cache(maxsize=None)
+def default_budgets() -> dict:
+
+    # the per-backbone budgets live only in the run config; states built outside the benchmark read them from there
+    config = OmegaConf.to_container(OmegaConf.load(CONFIG_PATH))
+    return (config.get("packing") or {}).get("budgets") or {}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(backbone: str):
+
+    try:
+        import tiktoken
+
+        # OpenAI models get their own BPE; for the others it is a close enough approximation
+        return tiktoken.get_encoding("o200k_base" if "gpt-4o" in backbone or "gpt-4.1" in backbone else "cl100k_base")
+
+    except Exception:
+        # tiktoken missing, or its encoding file cannot be downloaded; the character heuristic takes over
+        return None
+
+
+@lru_cache(maxsize=65536)
+def count_tokens(text: str, backbone: str = "default") -> int:
+
+    encoding = get_encoding(backbone)
+    if encoding is None:
+        return estimate_tokens(text)
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def format_document(doc: Document) -> str:
+
+    return f"Title: {doc.metadata.get('title', '')}\n Passage: {doc.page_content}"
+
+
+
+class ContextPacker:
+
+    @staticmethod
+    def budget(backbone: str, budgets: dict = None) -> int:
+
+        budgets = budgets or default_budgets()
+        return budgets.get(backbone, budgets.get("default"))
+
+
+    @staticmethod
+    def settings(config) -> tuple:
+
+        # (budget, min_score_ratio) for answer_query; no budget leaves the retrieved chunks untouched
+        if not config.context_packing:
+            return None, 0.0
+
+        budget = config.context_budget if config.context_budget is not None else ContextPacker.budget(config.backbone)
+        return budget, config.min_score_ratio
+
+
+    @staticmethod
+    def trim(query_terms: set, doc: Document, budget: int, backbone: str) -> Document:
+
+        title = doc.metadata.get('title', '')
+        passage = doc.metadata.get('passage') or doc.page_content
+        sentences = [sentence for sentence in SENTENCE.split(passage.strip()) if sentence]
+        overlap = [len(query_terms.intersection(tokenize(sentence))) for sentence in sentences]
+
+        # most relevant sentences first, ties in passage order, then put back in passage order
+        keep = []
+        used = count_tokens(format_document(Document(page_content=f"{title}\n", metadata=doc.metadata)), backbone)
+        for i in sorted(range(len(sentences)), key = lambda i: (-overlap[i], i)):
+            if overlap[i] == 0 and keep:
+                break
+
+            cost = count_tokens(sentences[i], backbone) + 1
+            if used + cost <= budget:
+                keep.append(i)
+                used += cost
+
+        if not keep:
+            return None
+
+        passage = " ".join(sentences[i] for i in sorted(keep))
+        return Document(page_content=f"{title}\n{passage}", metadata={**doc.metadata, 'passage': passage})
+
+
+    @staticmethod
+    def pack(query: str, docs: list, backbone: str, budget: int, min_score_ratio: float = 0.0) -> list:
+
+        raw_tokens = sum(count_tokens(format_document(doc), backbone) for doc in docs)
+        scores = [doc.metadata.get('score') for doc in docs if doc.metadata.get('score') is not None]
+        top = max(scores) if scores else None
+        query_terms = set(tokenize(query))
+
+        packed, remaining = [], budget
+        for doc in docs:
+            if remaining < MIN_TOKENS:
+                break
+
+            # the top chunk is always kept; the rest must score within min_score_ratio of it
+            score = doc.metadata.get('score')
+            if packed and top is not None and top > 0 and score is not None and score < min_score_ratio * top:
+                continue
+
+            cost = count_tokens(format_document(doc), backbone)
+            if cost > remaining:
+                doc = ContextPacker.trim(query_terms, doc, remaining, backbone)
+                if doc is None:
+                    continue
+                cost = count_tokens(format_document(doc), backbone)
+
+            packed.append(doc)
+            remaining -= cost
+
+        annotate(context_tokens_raw = raw_tokens, context_tokens_packed = budget - remaining)
+        return packed
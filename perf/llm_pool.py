@@ -0,0 +1,57 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("GROQ_API_KEY", "offline")
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from helper import LLM, AnswerOutputParser
+from time import perf_counter
+import argparse
+
+
+def time_calls(fn, num_calls: int) -> float:
+
+    start = perf_counter()
+    for _ in range(num_calls):
+        fn()
+
+    return (perf_counter() - start) / num_calls
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Per-call LLM client construction cost: fresh client vs pooled client.")
+    parser.add_argument("--calls", type = int, default = 200)
+    parser.add_argument("--backbone", type = str, default = "gpt-4o-mini")
+    args = parser.parse_args()
+
+    fake_model = FakeListChatModel(responses = ['{"answer": "Seattle"}'])
+    prompt = "Where is AeroHelix based?"
+
+    def fresh_client():
+        return LLM.get_gpt_model(model_name = args.backbone) if LLM.get_provider(args.backbone) == "openai" else LLM.get_groq_model(model_name = args.backbone)
+
+    def pooled_client():
+        return LLM.get_backbone_model(args.backbone)
+
+    def fresh_chain():
+        return (fake_model | AnswerOutputParser()).invoke(prompt)
+
+    def pooled_chain():
+        return LLM.get_chain(args.backbone, AnswerOutputParser).invoke(prompt)
+
+    fresh_client_time = time_calls(fresh_client, args.calls)
+    pooled_client_time = time_calls(pooled_client, args.calls)
+
+    LLM.set_fake_model(fake_model)
+    fresh_chain_time = time_calls(fresh_chain, args.calls)
+    pooled_chain_time = time_calls(pooled_chain, args.calls)
+    LLM.clear_cache()
+
+    print(f"{'mode':<10}{'client/call (ms)':>20}{'fake chain/call (ms)':>24}")
+    print(f"{'fresh':<10}{fresh_client_time * 1000:>20.3f}{fresh_chain_time * 1000:>24.3f}")
+    print(f"{'pooled':<10}{pooled_client_time * 1000:>20.3f}{pooled_chain_time * 1000:>24.3f}")
+
+
+if __name__ == "__main__":
+    main()
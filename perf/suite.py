@@ -0,0 +1,349 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "offline")
+os.environ.setdefault("GROQ_API_KEY", "offline")
+
+# a multi-threaded BLAS makes search timings depend on whatever else the machine is running
+for variable in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+    os.environ.setdefault(variable, "1")
+
+from helper import ReactOutputParse, QueryListOutputParser, AnswerOutputParser
+from prompt.analyze import get_analyze_prompt
+from prompt.query_decompose import get_query_decompose_prompt
+from prompt.query_answer import get_query_answer_prompt
+from prompt.answer import get_final_answer_prompt
+from state import State, Config, ReactOutput, Action
+from vectorstore import MemoryBackend, LocalBackend, VectorStorePool
+from bm25 import BM25Index, reciprocal_rank_fusion
+from offline import HashingEmbeddings, synthetic_dataset, setup
+from graph import create_graph, create_async_graph
+from results import write_json_atomic
+from time import perf_counter
+import numpy as np
+import subprocess
+import datetime
+import platform
+import tempfile
+import argparse
+import asyncio
+import json
+import sys
+
+
+BASELINE_DIR = os.path.join("perf", "baselines")
+RESULTS_PATH = os.path.join("perf", "results", "latest.json")
+
+OBSERVATION = [
+    ("Who created the Atlas-3 drone?", "It was built by AeroHelix."),
+    ("Where is AeroHelix based?", "AeroHelix is headquartered in Seattle."),
+    ("Who founded AeroHelix?", "AeroHelix was founded by Jordan Reeve in 2012."),
+    ("Who is the current CEO of AeroHelix?", "Mira Okafor has led AeroHelix since 2021.")
+]
+CHUNKS = [f"Title: Company{i}\n Passage: Company{i} is headquartered in City{i}. It was founded by Person{i} and partners with Company{i + 1}." for i in range(5)]
+QUESTION = "Who is the CEO of the company that developed the Atlas-3 drone?"
+
+
+def ops_per_sec(fn, min_time: float = 0.2, repeat: int = 5) -> float:
+
+    # calibrate a loop count that runs for about min_time, then keep the best of several loops
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = perf_counter() - start
+        if elapsed >= min_time / 4:
+            break
+        number *= 4
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (perf_counter() - start) / number)
+
+    return 1.0 / best
+
+
+def latency_ms(fn, calls: int) -> dict:
+
+    timings = []
+    for i in range(calls):
+        start = perf_counter()
+        fn(i)
+        timings.append((perf_counter() - start) * 1000)
+
+    return {"p50": float(np.percentile(timings, 50)), "p95": float(np.percentile(timings, 95))}
+
+
+def calibration_workload():
+
+    # fixed pure-Python work (dict, string and json churn) that tracks how fast this machine is right now
+    data = {f"key{i}": [i, str(i) * 3] for i in range(50)}
+    return json.loads(json.dumps(data))["key7"]
+
+
+def bench_parsers(results: dict, scale: float):
+
+    cases = {
+        "react": (ReactOutputParse(), '```json\n{"action": "RETRIEVE", "analysis": "We know the drone maker but not its CEO, so retrieve the current CEO of AeroHelix."}\n```'),
+        "query_list": (QueryListOutputParser(), '{"queries": ["Who is the CEO of AeroHelix?", "When did the CEO of AeroHelix take office?", "Who founded AeroHelix?"]}'),
+        "answer": (AnswerOutputParser(), '```json\n{"query": "Who is the CEO of AeroHelix?", "answer": "Mira Okafor"}\n```')
+    }
+
+    for name, (parser, text) in cases.items():
+        results[f"parser.{name}"] = {"value": ops_per_sec(lambda: parser.parse(text), min_time = 0.2 * scale), "unit": "ops/s", "better": "higher"}
+
+
+def bench_prompts(results: dict, scale: float):
+
+    cases = {
+        "analyze": lambda: get_analyze_prompt(QUESTION, OBSERVATION),
+        "query_decompose": lambda: get_query_decompose_prompt(QUESTION, "We know the drone maker but not its CEO."),
+        "query_answer": lambda: get_query_answer_prompt("Who is the CEO of AeroHelix?", CHUNKS),
+        "final_answer": lambda: get_final_answer_prompt(QUESTION, "AeroHelix built the drone and Mira Okafor leads it.", OBSERVATION)
+    }
+
+    for name, fn in cases.items():
+        results[f"prompt.{name}"] = {"value": ops_per_sec(fn, min_time = 0.2 * scale), "unit": "ops/s", "better": "higher"}
+
+
+def bench_state(results: dict, scale: float):
+
+    state = State(
+        question = QUESTION,
+        observation = OBSERVATION * 2,
+        react_output = ReactOutput(action = Action.RETRIEVE, analysis = "We know the drone maker but not its CEO."),
+        list_queries = [question for question, _ in OBSERVATION],
+        final_answer = "",
+        config = Config(backbone = "gpt-4o-mini", k = 5)
+    )
+    payload = state.model_dump_json()
+
+    cases = {
+        "copy": lambda: state.model_copy(),
+        "deepcopy": lambda: state.model_copy(deep = True),
+        "dump_json": lambda: state.model_dump_json(),
+        "validate_json": lambda: State.model_validate_json(payload)
+    }
+
+    for name, fn in cases.items():
+        results[f"state.{name}"] = {"value": ops_per_sec(fn, min_time = 0.2 * scale), "unit": "ops/s", "better": "higher"}
+
+
+def bench_vector_search(results: dict, scale: float, num_docs: int, k: int):
+
+    embeddings = HashingEmbeddings()
+    texts = [f"Company{i} is headquartered in City{i % 97}. It was founded by Person{i % 331}." for i in range(num_docs)]
+    vectors = embeddings.embed_documents(texts)
+    ids = [str(i) for i in range(num_docs)]
+    payloads = [{"title": f"Company{i}", "passage": text} for i, text in enumerate(texts)]
+    queries = [embeddings.embed_documents([f"Who founded Company{i}?", f"Where is Company{i} headquartered?"]) for i in range(max(20, int(200 * scale)))]
+
+    memory = MemoryBackend(dim = embeddings.dim)
+    memory.upsert(ids, vectors, payloads)
+
+    with tempfile.TemporaryDirectory() as index_path:
+        local = LocalBackend(index_path, dim = embeddings.dim)
+        local.upsert(ids, vectors, payloads)
+
+        for name, backend in [("memory", memory), ("local", local)]:
+            timings = latency_ms(lambda i: backend.search_batch(queries[i], k), len(queries))
+            results[f"search.{name}.p50"] = {"value": timings["p50"], "unit": "ms", "better": "lower"}
+            results[f"search.{name}.p95"] = {"value": timings["p95"], "unit": "ms", "better": "lower"}
+
+        local.close()
+
+    bm25 = BM25Index.build([(ids, payloads)])
+    texts = [[f"Who founded Company{i}?", f"Where is Company{i} headquartered?"] for i in range(len(queries))]
+    timings = latency_ms(lambda i: bm25.search(texts[i], k), len(texts))
+    results["search.bm25.p50"] = {"value": timings["p50"], "unit": "ms", "better": "lower"}
+    results["search.bm25.p95"] = {"value": timings["p95"], "unit": "ms", "better": "lower"}
+
+    # fusion at the store's default depth, on top of the dense search it follows
+    timings = latency_ms(lambda i: [reciprocal_rank_fusion([dense, sparse], k) for dense, sparse in zip(memory.search_batch(queries[i], 20), bm25.search(texts[i], 20))], len(texts))
+    results["search.hybrid.p50"] = {"value": timings["p50"], "unit": "ms", "better": "lower"}
+    results["search.hybrid.p95"] = {"value": timings["p95"], "unit": "ms", "better": "lower"}
+
+
+def bench_end_to_end(results: dict, scale: float, num_docs: int, num_questions: int):
+
+    config = {"offline": {"num_docs": num_docs, "num_questions": num_questions, "hops": 2, "num_queries": 2}}
+
+    with open(synthetic_dataset(num_docs = num_docs, num_questions = num_questions)[1], 'r') as file:
+        questions = [item["query"] for item in json.load(file)][:max(5, int(num_questions * scale))]
+
+    def state_for(question: str) -> State:
+        return State(question = question, config = Config(backbone = "gpt-4o-mini", early_stopping = 3, k = 5))
+
+    def fresh_store():
+        # embedding and retrieval caches would turn the second pass into hits, so each pass gets a cold store
+        VectorStorePool.close_all()
+        setup(config)
+
+    fresh_store()
+    graph = create_graph()
+    start = perf_counter()
+    for question in questions:
+        graph.invoke(state_for(question))
+    results["e2e.sync.questions_per_sec"] = {"value": len(questions) / (perf_counter() - start), "unit": "q/s", "better": "higher"}
+
+    async def run_async():
+        async_graph = create_async_graph()
+        await asyncio.gather(*[async_graph.ainvoke(state_for(question)) for question in questions])
+
+    fresh_store()
+    start = perf_counter()
+    asyncio.run(run_async())
+    results["e2e.async.questions_per_sec"] = {"value": len(questions) / (perf_counter() - start), "unit": "q/s", "better": "higher"}
+
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args) -> dict:
+
+    scale = 0.25 if args.quick else 1.0
+    results = {}
+
+    suites = {
+        "parsers": lambda round_results: bench_parsers(round_results, scale),
+        "prompts": lambda round_results: bench_prompts(round_results, scale),
+        "state": lambda round_results: bench_state(round_results, scale),
+        "search": lambda round_results: bench_vector_search(round_results, scale, args.docs, args.k),
+        "e2e": lambda round_results: bench_end_to_end(round_results, scale, args.docs, args.questions)
+    }
+
+    # every metric keeps its best round, which filters out most of the noise from other processes
+    for round_index in range(args.rounds):
+        round_results = {"calibration": {"value": ops_per_sec(calibration_workload, min_time = 0.2 * scale), "unit": "ops/s", "better": "higher"}}
+
+        for name in args.only or suites.keys():
+            start = perf_counter()
+            suites[name](round_results)
+            print(f"round {round_index + 1}/{args.rounds} {name:<10} done in {perf_counter() - start:.1f}s")
+
+        for metric, result in round_results.items():
+            best = results.get(metric)
+            if best is None or (result["value"] > best["value"] if result["better"] == "higher" else result["value"] < best["value"]):
+                results[metric] = result
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec = "seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "rounds": args.rounds
+        },
+        "results": results
+    }
+
+    write_json_atomic(args.output, report, indent = 2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    if args.save_baseline:
+        baseline_path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        write_json_atomic(baseline_path, report, indent = 2)
+        print(f"Saved baseline {baseline_path}")
+
+    return report
+
+
+def compare(args) -> int:
+
+    for path, hint in [(args.baseline, "save one with `python -m perf.suite run --save-baseline <name>`"), (args.current, "run `python -m perf.suite run` first")]:
+        if not os.path.exists(path):
+            print(f"No report at {path}: {hint}.")
+            return 2
+
+    with open(args.baseline, 'r') as file:
+        baseline_report = json.load(file)
+    with open(args.current, 'r') as file:
+        current_report = json.load(file)
+
+    baseline, current = baseline_report["results"], current_report["results"]
+    if baseline_report["meta"].get("quick") != current_report["meta"].get("quick"):
+        print("Warning: comparing a --quick run against a full run, expect spurious differences.")
+
+    # with --normalize both runs are rescaled to the same machine speed, measured by the calibration workload
+    speed = 1.0
+    if args.normalize and "calibration" in baseline and "calibration" in current:
+        speed = current["calibration"]["value"] / baseline["calibration"]["value"]
+        print(f"Machine speed vs baseline: {speed:.2f}x, normalizing.")
+
+    regressions = []
+    print(f"{'metric':<32}{'baseline':>14}{'current':>14}{'change':>10}  status")
+
+    for name, base in baseline.items():
+        if name == "calibration":
+            continue
+
+        # a metric that stopped being measured fails too, otherwise dropping a suite would pass the gate
+        if name not in current:
+            print(f"{name:<32}{base['value']:>14.3f}{'-':>14}{'-':>10}  MISSING")
+            regressions.append(name)
+            continue
+
+        value = current[name]["value"]
+        value = value / speed if base["better"] == "higher" else value * speed
+        # change is signed so that positive always means faster, whichever direction the metric improves in
+        change = (value - base["value"]) / base["value"] if base["value"] else 0.0
+        if base["better"] == "lower":
+            change = -change
+
+        status = "ok"
+        if change < -args.threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change > args.threshold:
+            status = "improved"
+
+        print(f"{name:<32}{base['value']:>14.3f}{value:>14.3f}{change:>+10.1%}  {status}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold:.0%} or missing: {', '.join(regressions)}")
+        return 1
+
+    print(f"No regression over {args.threshold:.0%}.")
+    return 0
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Pipeline performance suite: parsers, prompt rendering, State copies, vector search and offline end-to-end throughput.")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--output", type = str, default = RESULTS_PATH)
+    run_parser.add_argument("--save-baseline", type = str, default = None, help = "also store the results as perf/baselines/<name>.json")
+    run_parser.add_argument("--only", type = str, nargs = "+", choices = ["parsers", "prompts", "state", "search", "e2e"])
+    run_parser.add_argument("--docs", type = int, default = 5000)
+    run_parser.add_argument("--questions", type = int, default = 40)
+    run_parser.add_argument("--k", type = int, default = 5)
+    run_parser.add_argument("--rounds", type = int, default = 3)
+    run_parser.add_argument("--quick", action = "store_true")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("--baseline", type = str, default = os.path.join(BASELINE_DIR, "default.json"))
+    compare_parser.add_argument("--current", type = str, default = RESULTS_PATH)
+    compare_parser.add_argument("--threshold", type = float, default = 0.1)
+    compare_parser.add_argument("--normalize", action = "store_true", help = "rescale by the calibration workload before comparing")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
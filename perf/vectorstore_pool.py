@@ -0,0 +1,69 @@
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from vectorstore import VectorStore, VectorStorePool
+from time import perf_counter
+import argparse
+import uuid
+
+
+COLLECTION_NAME = "multi-hop-rag-bench"
+
+
+def seed_collection(store: VectorStore, num_points: int):
+
+    texts = [f"Passage number {i}" for i in range(num_points)]
+    vectors = store.embedding_model.embed_documents(texts)
+
+    store.upsert(
+        ids = [str(uuid.uuid4()) for _ in texts],
+        vectors = vectors,
+        payloads = [{"title": f"Title {i}", "passage": text} for i, text in enumerate(texts)]
+    )
+
+
+def run_hops(get_store, num_hops: int, k: int):
+
+    setup_time = 0.0
+    search_time = 0.0
+
+    for i in range(num_hops):
+        start = perf_counter()
+        store = get_store()
+        setup_time += perf_counter() - start
+
+        start = perf_counter()
+        store.similarity_search(f"Sub question {i}", k = k)
+        search_time += perf_counter() - start
+
+    return setup_time / num_hops, search_time / num_hops
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Per-hop VectorStore setup cost: fresh instance vs pooled instance.")
+    parser.add_argument("--hops", type = int, default = 200)
+    parser.add_argument("--k", type = int, default = 5)
+    parser.add_argument("--points", type = int, default = 500)
+    args = parser.parse_args()
+
+    embedding_model = DeterministicFakeEmbedding(size = 768)
+
+    def fresh_store():
+        return VectorStore(collection_name = COLLECTION_NAME, url = ":memory:", embedding_model = embedding_model)
+
+    def pooled_store():
+        return VectorStorePool.get(collection_name = COLLECTION_NAME, url = ":memory:", embedding_model = embedding_model)
+
+    seed_collection(pooled_store(), args.points)
+
+    fresh_setup, fresh_search = run_hops(fresh_store, args.hops, args.k)
+    pooled_setup, pooled_search = run_hops(pooled_store, args.hops, args.k)
+
+    print(f"{'mode':<10}{'setup/hop (ms)':>18}{'search/hop (ms)':>18}")
+    print(f"{'fresh':<10}{fresh_setup * 1000:>18.3f}{fresh_search * 1000:>18.3f}")
+    print(f"{'pooled':<10}{pooled_setup * 1000:>18.3f}{pooled_search * 1000:>18.3f}")
+
+    VectorStorePool.close_all()
+
+
+if __name__ == "__main__":
+    main()
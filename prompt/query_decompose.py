@@ -8,10 +8,12 @@ Given a main question and the previous step's analysis, your task is to generate
 
 MPORTANT: To avoid JSON parsing errors, DO NOT use any double quotes (") or single quotes (') within your queries values. Use alternative wording if you need to mention something that would typically be in quotes.
 
+When the main question names a news source, an article title or a publication date, a query can instead be an object with a "filter" restricting the search to matching articles. Allowed filter keys: "source" (a source name or a list of names), "title" (words from the article title), "published_after" and "published_before" (dates as YYYY-MM-DD, both inclusive). Only filter on what the question states explicitly.
+
 Output format (strictly) in the following JSON structure:
 ```json
 {{
-    "queries": [list of sub-questions or keywords]
+    "queries": [list of sub-questions or keywords, or objects {{"query": sub-question, "filter": {{...}}}}]
 }}
 ```
 ---
@@ -52,6 +54,23 @@ Output:
     ]
 }}
 ```
+## Example 3:
+
+[QUESTION]:  
+"Did the Zee Business article from November 18, 2023 and the TechCrunch article from November 20, 2023 report the same acquisition price?"
+
+[ANALYSIS]:  
+"We need the acquisition price reported by each of the two articles before they can be compared."
+
+Output:
+```json
+{{
+    "queries": [
+        {{"query": "What acquisition price did Zee Business report?", "filter": {{"source": "Zee Business", "published_after": "2023-11-18", "published_before": "2023-11-18"}}}},
+        {{"query": "What acquisition price did TechCrunch report?", "filter": {{"source": "TechCrunch", "published_after": "2023-11-20", "published_before": "2023-11-20"}}}}
+    ]
+}}
+```
 Given:
 
 [QUESTION]: {question}  
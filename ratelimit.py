@@ -0,0 +1,171 @@
+import threading
+import asyncio
+import random
+import time
+from tracing import annotate
+
+
+class TokenBucket:
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def _try_acquire(self, amount: float) -> float:
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+
+            return (amount - self.tokens) / self.rate
+
+
+    def acquire(self, amount: float = 1.0):
+
+        amount = min(amount, self.capacity)
+
+        while True:
+            wait = self._try_acquire(amount)
+            if wait <= 0:
+                return
+
+            time.sleep(wait)
+
+
+    async def aacquire(self, amount: float = 1.0):
+
+        amount = min(amount, self.capacity)
+
+        # the lock is only held for the refill arithmetic, so waiting here never blocks the event loop
+        while True:
+            wait = self._try_acquire(amount)
+            if wait <= 0:
+                return
+
+            await asyncio.sleep(wait)
+
+
+
+class ProviderRateLimiter:
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+
+    def acquire(self, num_tokens: int = 0):
+
+        if self.requests is not None:
+            self.requests.acquire(1)
+
+        if self.tokens is not None and num_tokens > 0:
+            self.tokens.acquire(num_tokens)
+
+
+    async def aacquire(self, num_tokens: int = 0):
+
+        if self.requests is not None:
+            await self.requests.aacquire(1)
+
+        if self.tokens is not None and num_tokens > 0:
+            await self.tokens.aacquire(num_tokens)
+
+
+
+class RateLimiter:
+
+    _limiters = {}
+    _lock = threading.Lock()
+
+
+    @staticmethod
+    def configure(provider: str, requests_per_minute: float = None, tokens_per_minute: float = None):
+
+        with RateLimiter._lock:
+            if not requests_per_minute and not tokens_per_minute:
+                RateLimiter._limiters.pop(provider, None)
+                return
+
+            RateLimiter._limiters[provider] = ProviderRateLimiter(
+                requests_per_minute = requests_per_minute,
+                tokens_per_minute = tokens_per_minute
+            )
+
+
+    @staticmethod
+    def get(provider: str) -> ProviderRateLimiter:
+
+        return RateLimiter._limiters.get(provider)
+
+
+    @staticmethod
+    def reset():
+
+        with RateLimiter._lock:
+            RateLimiter._limiters.clear()
+
+
+
+def estimate_tokens(text: str) -> int:
+
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and getattr(error, "response", None) is not None:
+        status_code = getattr(error.response, "status_code", None)
+
+    if status_code == 429:
+        return True
+
+    message = str(error).lower()
+    return "429" in message or "rate limit" in message or "resource exhausted" in message or "resource_exhausted" in message
+
+
+_jitter = random.Random()
+
+def call_with_backoff(fn, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+
+    attempt = 0
+    while True:
+        try:
+            return fn()
+
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            annotate(retries = 1)
+            time.sleep(delay + _jitter.uniform(0, delay / 2))
+            attempt += 1
+
+
+async def acall_with_backoff(fn, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+
+        except Exception as e:
+            if not is_rate_limit_error(e) or attempt >= max_retries:
+                raise
+
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            annotate(retries = 1)
+            await asyncio.sleep(delay + _jitter.uniform(0, delay / 2))
+            attempt += 1
@@ -0,0 +1,81 @@
+from langchain.schema import Document
+from tracing import span
+import numpy as np
+import threading
+
+
+DEFAULT_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+
+    _models = {}
+    _lock = threading.Lock()
+    _fake_model = None
+
+    batch_size = 64
+
+
+    @staticmethod
+    def get_model(model_name: str = DEFAULT_MODEL):
+
+        if Reranker._fake_model is not None:
+            return Reranker._fake_model
+
+        # loaded on first use and kept for the life of the process, so only runs with rerank on pay for torch
+        with Reranker._lock:
+            model = Reranker._models.get(model_name)
+
+            if model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise ValueError(f"Reranking needs sentence-transformers (pip install -r requirements.txt): {e}")
+
+                model = CrossEncoder(model_name, device = "cpu")
+                Reranker._models[model_name] = model
+
+        return model
+
+
+    @staticmethod
+    def set_fake_model(model):
+
+        with Reranker._lock:
+            Reranker._fake_model = model
+
+
+    @staticmethod
+    def clear_cache():
+
+        with Reranker._lock:
+            Reranker._models.clear()
+            Reranker._fake_model = None
+
+
+    @staticmethod
+    def rerank(queries: list, docs_list: list, k: int, model_name: str = DEFAULT_MODEL) -> list:
+
+        # every (sub-query, candidate) pair of the hop goes through one predict call, batched on the CPU;
+        # page_content already starts with the title, so it goes in as is
+        pairs = [(query, doc.page_content) for query, docs in zip(queries, docs_list) for doc in docs]
+        if not pairs:
+            return [list(docs) for docs in docs_list]
+
+        model = Reranker.get_model(model_name)
+        with span("rerank"):
+            scores = np.asarray(model.predict(pairs, batch_size = Reranker.batch_size, show_progress_bar = False), dtype=np.float32).reshape(-1)
+
+        results, start = [], 0
+        for docs in docs_list:
+            doc_scores = scores[start:start + len(docs)]
+            start += len(docs)
+
+            # the retrieval score is kept in "score", so the exit policy and packing still read the scale they expect
+            order = np.argsort(-doc_scores, kind="stable")[:k]
+            results.append([
+                Document(page_content = docs[i].page_content, metadata = {**docs[i].metadata, "rerank_score": float(doc_scores[i])})
+                for i in order
+            ])
+
+        return results
@@ -0,0 +1,180 @@
+import json
+import hashlib
+import os
+
+
+RESULT_CONFIG_KEYS = ["backbone", "k", "early_stopping", "batch_retrieval", "early_exit", "retrieval_mode", "metadata_filters", "evidence_memory", "rerank", "packing", "offline", "vector_backend", "ann"]
+
+
+def question_hash(item: dict) -> str:
+
+    content = json.dumps({
+        "query": item.get("query", ""),
+        "answer": item.get("answer", "")
+    }, sort_keys=True)
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def config_hash(config: dict) -> str:
+
+    content = json.dumps({key: config.get(key) for key in RESULT_CONFIG_KEYS}, sort_keys=True)
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def write_json_atomic(path: str, data: dict, indent: int = None):
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file, indent=indent)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_path, path)
+
+
+def read_records(path: str) -> list:
+
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # a crash mid-append can leave a truncated last line
+                break
+
+    return records
+
+
+
+def compare_records(records: list, baseline: list) -> dict:
+
+    # only questions answered by both runs are compared, so a partial baseline still gives a fair delta
+    baseline = {record["qid"]: record for record in baseline if record.get("qid")}
+    pairs = [(record, baseline[record["qid"]]) for record in records if record.get("qid") in baseline]
+    if not pairs:
+        return {}
+
+    def mean(values):
+        values = list(values)
+        return sum(values) / len(values)
+
+    comparison = {"num_questions": len(pairs)}
+    for key in ["f1_score", "num_iterations", "tokens", "prompt_tokens"]:
+        current = mean(record.get(key) or 0 for record, _ in pairs)
+        previous = mean(record.get(key) or 0 for _, record in pairs)
+        comparison[f"baseline_{key}"] = previous
+        comparison[f"{key}"] = current
+        comparison[f"{key}_delta"] = current - previous
+
+    comparison["iterations_saved"] = sum((old.get("num_iterations") or 0) - (new.get("num_iterations") or 0) for new, old in pairs)
+    comparison["tokens_saved"] = sum((old.get("tokens") or 0) - (new.get("tokens") or 0) for new, old in pairs)
+
+    return comparison
+
+
+
+class ResultWriter:
+
+    def __init__(self, output_dir: str, id: str, part: int, fsync_every: int = 10, resume_hash: str = None):
+
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.records_path = os.path.join(output_dir, f"results_{id}_part{part}.jsonl")
+        self.summary_path = os.path.join(output_dir, f"summary_{id}_part{part}.json")
+        self.legacy_path = os.path.join(output_dir, f"results_{id}_part{part}.json")
+        self.latency_path = os.path.join(output_dir, f"latency_{id}_part{part}.json")
+        self.fsync_every = fsync_every
+        self.completed = {}
+
+        if resume_hash is not None:
+            self.completed = {
+                record["qid"]: record
+                for record in read_records(self.records_path)
+                if record.get("qid") and record.get("config_hash") == resume_hash
+            }
+
+        # rewrite the checkpoint so stale records and a truncated tail never precede new appends
+        self._write_records(list(self.completed.values()))
+
+        self._file = open(self.records_path, 'a')
+        self._pending = 0
+
+
+    def _write_records(self, records: list):
+
+        tmp_path = f"{self.records_path}.tmp"
+
+        with open(tmp_path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, self.records_path)
+
+
+    def append(self, record: dict):
+
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._pending += 1
+
+        if self._pending >= self.fsync_every:
+            self.sync()
+
+
+    def sync(self):
+
+        if self._pending:
+            os.fsync(self._file.fileno())
+            self._pending = 0
+
+
+    def write_summary(self, metrics: dict, config: dict, num_records: int):
+
+        write_json_atomic(self.summary_path, {
+            "metrics": metrics,
+            "config": config,
+            "num_records": num_records
+        })
+
+
+    def write_legacy(self, metrics: dict, config: dict, records: list):
+
+        write_json_atomic(self.legacy_path, {
+            "metrics": metrics,
+            "config": config,
+            "sampled_data": records
+        }, indent=2)
+
+
+    def write_latency(self, table: dict):
+
+        write_json_atomic(self.latency_path, table, indent=2)
+
+
+    def close(self):
+
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 
 class ProcessingState(str, Enum):
@@ -47,6 +47,86 @@ class Config(BaseModel):
         description="The number of top results to retrieve from the vector store."
     )
 
+    max_concurrency : int = Field(
+        default=4, 
+        description="The maximum number of sub-queries answered concurrently within a single RAG hop (1 runs them sequentially)."
+    )
+
+    batch_retrieval : bool = Field(
+        default=True, 
+        description="Embed and search all sub-queries of a hop in a single batched round-trip."
+    )
+
+    retrieval_mode : str = Field(
+        default="dense", 
+        description="How sub-queries are matched against the corpus: dense (embeddings), bm25 (keywords) or hybrid (both, fused by reciprocal rank)."
+    )
+
+    metadata_filters : bool = Field(
+        default=True, 
+        description="Apply the source, title and date filters emitted by query decomposition inside the vector search."
+    )
+
+    evidence_memory : bool = Field(
+        default=True, 
+        description="Reuse earlier answers for sub-queries that repeat one already answered for this question (needs dense or hybrid retrieval for the query embeddings)."
+    )
+
+    dedup_similarity : float = Field(
+        default=0.95, 
+        description="Cosine similarity between sub-query embeddings above which a sub-query counts as already answered."
+    )
+
+    merge_similarity : float = Field(
+        default=0.85, 
+        description="Looser similarity at which a sub-query skips the chunks already read for a similar earlier sub-query."
+    )
+
+    rerank : bool = Field(
+        default=False, 
+        description="Rerank k * rerank_multiplier retrieved candidates per sub-query with a local cross-encoder and keep the top k."
+    )
+
+    rerank_model : str = Field(
+        default="cross-encoder/ms-marco-MiniLM-L-6-v2", 
+        description="sentence-transformers CrossEncoder used for reranking, loaded once per process on first use."
+    )
+
+    rerank_multiplier : int = Field(
+        default=4, 
+        description="How many times k candidates to retrieve for the reranker to choose from."
+    )
+
+    context_packing : bool = Field(
+        default=False, 
+        description="Pack the retrieved chunks of each sub-query into a token budget before they reach the answer prompt."
+    )
+
+    context_budget : Optional[int] = Field(
+        default=None, 
+        description="Context token budget per sub-query answer prompt; None uses the backbone's budget from packing.budgets in config/default.yaml."
+    )
+
+    min_score_ratio : float = Field(
+        default=0.0, 
+        description="When packing, drop chunks scoring below this fraction of the top chunk's score (the top chunk is always kept)."
+    )
+
+    early_exit : bool = Field(
+        default=False, 
+        description="Stop looping once a hop adds no confident or new evidence, instead of waiting for an ANSWER action."
+    )
+
+    min_retrieval_score : float = Field(
+        default=0.45, 
+        description="Exit when the best retrieved score of a hop falls below this value (dense retrieval only, fused and BM25 scores are on other scales)."
+    )
+
+    min_novelty : float = Field(
+        default=0.25, 
+        description="Exit when less than this fraction of a hop's retrieved chunks were unseen on earlier hops."
+    )
+
 
 
 
@@ -75,11 +155,42 @@ class State(BaseModel):
         description="A list of queries generated during the query decomposition step."
     )
 
+    query_filters : List[Optional[dict]] = Field(
+        default=[], 
+        description="The metadata filter of each query in list_queries (None when a query has no filter)."
+    )
+
     final_answer: str = Field(
         default=None, 
         description="The final answer generated by the system after processing the question and observations."
     )
 
+    asked_queries : List[str] = Field(
+        default=[], 
+        description="Every sub-query answered so far, across hops."
+    )
+
+    seen_ids : List[str] = Field(
+        default=[], 
+        description="Ids of the chunks retrieved so far, across hops."
+    )
+
+    evidence : List[dict] = Field(
+        default=[], 
+        description="Answered sub-queries of this question with the chunk ids read and the answer."
+    )
+
+    evidence_embeddings : List[List[float]] = Field(
+        default=[], 
+        exclude=True, 
+        description="Query embedding of each evidence entry, kept out of dumps and traces (a state restored without them skips evidence matching)."
+    )
+
+    exit_reason : Optional[str] = Field(
+        default=None, 
+        description="Why the loop stopped before an ANSWER action, when early exit is enabled."
+    )
+
 
     config: Config = Field(
         default=Config(), 
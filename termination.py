@@ -0,0 +1,80 @@
+from state import State, ProcessingState
+from cache import EmbeddingCache
+
+
+NO_INFORMATION = ["no information", "insufficient information", "not enough information", "not mentioned", "not provided"]
+
+
+
+class ExitPolicy:
+
+    @staticmethod
+    def is_informative(answer: str) -> bool:
+
+        answer = EmbeddingCache.normalize(str(answer))
+        return bool(answer) and not any(phrase in answer for phrase in NO_INFORMATION)
+
+
+    @staticmethod
+    def filter_queries(state: State) -> State:
+
+        if not state.config.early_exit:
+            return state
+
+        # a sub-query answered on an earlier hop would only retrieve the same chunks again
+        seen = {EmbeddingCache.normalize(query) for query in state.asked_queries}
+        queries, filters = [], []
+        for query, filter_dict in zip(state.list_queries, state.query_filters or [None] * len(state.list_queries)):
+            key = EmbeddingCache.normalize(query)
+            if key not in seen:
+                seen.add(key)
+                queries.append(query)
+                filters.append(filter_dict)
+
+        state.list_queries = queries
+        state.query_filters = filters
+        if not queries:
+            state.exit_reason = "repeated_queries"
+
+        return state
+
+
+    @staticmethod
+    def assess(state: State, docs_list: list, observations: list) -> State:
+
+        ids = {str(doc.metadata.get("id")) for docs in docs_list for doc in docs}
+        scores = [doc.metadata["score"] for docs in docs_list for doc in docs if doc.metadata.get("score") is not None]
+        previous = {EmbeddingCache.normalize(str(answer)) for _, answer in state.observation}
+
+        new_ids = sorted(ids.difference(state.seen_ids))
+        novelty = len(new_ids) / len(ids) if ids else 0.0
+        first_hop = not state.asked_queries
+        informative = [
+            answer for _, answer in observations
+            if ExitPolicy.is_informative(answer) and EmbeddingCache.normalize(str(answer)) not in previous
+        ]
+
+        state.seen_ids.extend(new_ids)
+        state.asked_queries.extend(state.list_queries)
+
+        if not state.config.early_exit:
+            return state
+
+        if state.config.retrieval_mode == "dense" and scores and max(scores) < state.config.min_retrieval_score:
+            state.exit_reason = "low_retrieval_score"
+        elif not informative:
+            state.exit_reason = "no_new_answers"
+        elif not first_hop and novelty < state.config.min_novelty:
+            state.exit_reason = "no_new_evidence"
+
+        return state
+
+
+    @staticmethod
+    def route(state: State, next_node: str) -> str:
+
+        if state.exit_reason is not None:
+            state.processing_state = ProcessingState.GENERATE_ANSWER
+            return "generate_answer"
+
+        return next_node
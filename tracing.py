@@ -0,0 +1,195 @@
+from contextlib import contextmanager
+from time import perf_counter
+import contextvars
+import threading
+import functools
+import inspect
+import numpy as np
+
+
+COUNTERS = ["prompt_tokens", "completion_tokens", "retries", "cache_hits", "reused_answers", "context_tokens_raw", "context_tokens_packed", "relaxed_filters"]
+PERCENTILES = [50, 95, 99]
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+
+class Trace:
+
+    def __init__(self):
+
+        self.spans = []
+        self.started_at = perf_counter()
+        self.wall_s = 0.0
+        self._lock = threading.Lock()
+
+
+    def add(self, record: dict):
+
+        with self._lock:
+            self.spans.append(record)
+
+
+    def annotate(self, record: dict, counts: dict):
+
+        with self._lock:
+            for key, value in counts.items():
+                record[key] = record.get(key, 0) + value
+
+
+    def summary(self) -> dict:
+
+        spans = {}
+        for record in self.spans:
+            entry = spans.setdefault(record["name"], {"count": 0, "wall_s": 0.0, **{key: 0 for key in COUNTERS}})
+            entry["count"] += 1
+            entry["wall_s"] += record["wall_s"]
+            for key in COUNTERS:
+                entry[key] += record.get(key, 0)
+
+        return {"wall_s": self.wall_s, "spans": spans}
+
+
+
+@contextmanager
+def trace():
+
+    current = Trace()
+    token = _trace.set(current)
+
+    try:
+        yield current
+    finally:
+        current.wall_s = perf_counter() - current.started_at
+        _trace.reset(token)
+
+
+@contextmanager
+def span(name: str):
+
+    current = _trace.get()
+    if current is None:
+        yield None
+        return
+
+    record = {"name": name, "wall_s": 0.0}
+    token = _span.set(record)
+    start = perf_counter()
+
+    try:
+        yield record
+    finally:
+        record["wall_s"] = perf_counter() - start
+        _span.reset(token)
+        current.add(record)
+
+
+def annotate(**counts):
+
+    current, record = _trace.get(), _span.get()
+    if current is not None and record is not None:
+        current.annotate(record, counts)
+
+
+def record_usage(message):
+
+    usage = getattr(message, "usage_metadata", None) or {}
+    annotate(
+        prompt_tokens = usage.get("input_tokens", 0),
+        completion_tokens = usage.get("output_tokens", 0)
+    )
+
+    return message
+
+
+async def arecord_usage(message):
+
+    return record_usage(message)
+
+
+def traced(name: str, fn):
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def propagate(fn):
+
+    # executor threads start with an empty context; each call gets its own copy of the submitter's
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
+
+
+def total_tokens(summary: dict) -> int:
+
+    if not summary:
+        return 0
+
+    return sum(entry["prompt_tokens"] + entry["completion_tokens"] for entry in summary["spans"].values())
+
+
+def total(summary: dict, key: str) -> int:
+
+    if not summary:
+        return 0
+
+    return sum(entry[key] for entry in summary["spans"].values())
+
+
+def aggregate(summaries: list) -> dict:
+
+    summaries = [summary for summary in summaries if summary]
+    if not summaries:
+        return {}
+
+    # percentiles and counter means are per question, so a node called on every hop counts once per question
+    names = sorted({name for summary in summaries for name in summary["spans"]})
+    columns = {"question": [summary["wall_s"] for summary in summaries]}
+    counters = {}
+    for name in names:
+        entries = [summary["spans"].get(name) for summary in summaries]
+        columns[name] = [entry["wall_s"] if entry else 0.0 for entry in entries]
+        counters[name] = {key: sum(entry[key] for entry in entries if entry) for key in COUNTERS}
+
+    table = {}
+    for name, values in columns.items():
+        values = np.asarray(values, dtype=np.float64)
+        row = {"count": len(values), "mean_s": float(values.mean())}
+        row.update({f"p{q}_s": float(np.percentile(values, q)) for q in PERCENTILES})
+
+        if name in counters:
+            row.update({key: value / len(values) for key, value in counters[name].items()})
+
+        table[name] = row
+
+    return table
+
+
+def print_table(table: dict):
+
+    header = f"{'span':<18}{'mean_s':>10}" + "".join(f"{f'p{q}_s':>10}" for q in PERCENTILES) + f"{'in_tok':>10}{'out_tok':>10}{'retries':>10}{'hits':>8}"
+    print(header)
+
+    for name, row in table.items():
+        print(
+            f"{name:<18}{row['mean_s']:>10.3f}" + "".join(f"{row[f'p{q}_s']:>10.3f}" for q in PERCENTILES)
+            + f"{row.get('prompt_tokens', 0):>10.1f}{row.get('completion_tokens', 0):>10.1f}{row.get('retries', 0):>10.2f}{row.get('cache_hits', 0):>8.2f}"
+        )
+
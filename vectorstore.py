@@ -1,41 +1,105 @@
-import json 
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv 
 from langchain_qdrant import QdrantVectorStore
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance
-from qdrant_client.models import PointStruct
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http.models import VectorParams, Distance, PayloadSchemaType, TextIndexParams, TextIndexType, TokenizerType
+from qdrant_client.models import PointStruct, QueryRequest
 from  langchain.schema import Document 
 import os 
-from tqdm import tqdm
-import uuid 
+import asyncio
+import threading
+from contextlib import nullcontext
+import atexit
+import time 
+import numpy as np
+from cache import EmbeddingCache, RetrievalCache
+from local_index import LocalVectorIndex
+from ann_index import IVFPQIndex
+from bm25 import BM25Index, reciprocal_rank_fusion
+from filters import PayloadIndex, normalize_filter, filter_key, to_qdrant
+from ingest import IngestionPipeline
+from tracing import span, annotate
 
 
 load_dotenv(dotenv_path = ".env")
 
-class VectorStore: 
+RETRIEVAL_MODES = ["dense", "bm25", "hybrid"]
 
-    def __init__(self, collection_name: str = "multi-hop-rag"):
-        self.embedding_model = GoogleGenerativeAIEmbeddings(
-            model = "models/text-embedding-004", 
-            google_api_key = os.getenv("GEMINI_API_KEY")
-        )
 
-        self.collection_name = collection_name
+class VectorBackend: 
 
-        self.qdrant_client = QdrantClient(
-            url = os.getenv("QDRANT_URL"), 
-            api_key = os.getenv("QDRANT_API_KEY")
-        )
+    def upsert(self, ids: list, vectors: list, payloads: list): 
+        raise NotImplementedError
+
+
+    @staticmethod
+    def _groups(filters: list) -> dict: 
+
+        groups = {}
+        for i, filter_dict in enumerate(filters): 
+            groups.setdefault(filter_key(filter_dict), (filter_dict, []))[1].append(i)
+
+        return groups
+
+
+    def _search_filtered(self, vectors: list, k: int, filter_dict: dict = None) -> list: 
+        raise NotImplementedError
+
+
+    def search_batch(self, vectors: list, k: int, filters: list = None) -> list: 
+
+        # filters holds one filter (or None) per vector; in-process backends apply a row mask, so they scan once per distinct filter
+        if not filters: 
+            return self._search_filtered(vectors, k)
+
+        results = [None] * len(vectors)
+        for filter_dict, indices in VectorBackend._groups(filters).values(): 
+            for i, result in zip(indices, self._search_filtered([vectors[i] for i in indices], k, filter_dict)): 
+                results[i] = result
+
+        return results
+
+
+    async def asearch_batch(self, vectors: list, k: int, filters: list = None) -> list: 
+        return await asyncio.to_thread(self.search_batch, vectors, k, filters)
 
 
+    def scan(self, batch_size: int = 1000): 
+        raise NotImplementedError
+
+
+    def health_check(self) -> bool: 
+        return True 
+
+
+    def close(self): 
+        pass 
+
+
+
+class QdrantBackend(VectorBackend): 
+
+    def __init__(self, collection_name: str, url: str = None, api_key: str = None, dim: int = 768): 
+
+        self.collection_name = collection_name
+        self.dim = dim 
+        self.url = url 
+        self.api_key = api_key if api_key is not None else os.getenv("QDRANT_API_KEY")
+        self._async_client = None 
+
+        # the embedded in-memory client is not safe for concurrent writes, a remote server is
+        self._write_lock = threading.Lock() if url == ":memory:" else nullcontext()
+
+        if url == ":memory:":
+            self.qdrant_client = QdrantClient(location = ":memory:")
+        else: 
+            self.qdrant_client = QdrantClient(
+                url = url, 
+                api_key = self.api_key
+            )
+
         self._setup()
 
-        self.vector_store = QdrantVectorStore(
-            client = self.qdrant_client, 
-            collection_name = self.collection_name, 
-            embedding = self.embedding_model
-        )
 
     def _setup(self): 
 
@@ -43,105 +107,774 @@ class VectorStore:
             all_collections = self.qdrant_client.get_collections()
             collection_names = [collection.name for collection in all_collections.collections]
 
-            if "multi-hop-rag" not in collection_names:
+            if self.collection_name not in collection_names:
 
                 self.qdrant_client.create_collection(
-                    collection_name = "multi-hop-rag", 
+                    collection_name = self.collection_name, 
                     vectors_config = VectorParams(
-                        size = 768, 
+                        size = self.dim, 
                         distance = Distance.COSINE
                     )
                 )
 
+            # payload indexes let Qdrant apply filters inside the HNSW search instead of scanning payloads
+            text_index = TextIndexParams(type = TextIndexType.TEXT, tokenizer = TokenizerType.WORD, lowercase = True)
+            existing = self.qdrant_client.get_collection(self.collection_name).payload_schema or {}
+            for field_name, field_schema in [("source", text_index), ("title", text_index), ("published_at", PayloadSchemaType.DATETIME)]: 
+                if field_name not in existing: 
+                    self.qdrant_client.create_payload_index(
+                        collection_name = self.collection_name, 
+                        field_name = field_name, 
+                        field_schema = field_schema
+                    )
+
         except Exception as e:
             raise Exception(f"Error setting up Qdrant collection: {e}")
 
 
+    def upsert(self, ids: list, vectors: list, payloads: list): 
 
-    def load_documents_from_json(self, json_path: str): 
+        with self._write_lock: 
+            self.qdrant_client.upsert(
+                collection_name = self.collection_name, 
+                points = [
+                    PointStruct(id = point_id, vector = vector, payload = payload) 
+                    for point_id, vector, payload in zip(ids, vectors, payloads)
+                ]
+            )
 
-        try : 
-            with open(json_path, 'r') as file:
-                data = json.load(file)
-
-            documents = []
-            texts = []
-            metadata = []
-            points = []
-            for item in tqdm(data, desc="Loading documents"):
-
-                title = item.get('title', 'No Title')
-                passage = item.get('passage', 'No Passage')
-                embedding = item.get('embeddings', None)
-
-                doc = Document(
-                    page_content = f"{title}\n{passage}",
-                    metadata = {
-                        'title': title,
-                        'passage': passage,
-                    }
-                )
 
-                documents.append(doc)
-                texts.append(doc.page_content)
-                metadata.append(doc.metadata)
+    def _requests(self, vectors: list, k: int, filters: list = None) -> list: 
 
-                point = PointStruct(
-                    id = str(uuid.uuid4()), 
-                    vector = embedding if embedding is not None and len(embedding) == 768 else self.embedding_model.embed_query(doc.page_content),
-                    payload = doc.metadata
-                )
+        # every request carries its own filter, so a hop with mixed filters is still a single round-trip
+        filters = filters or [None] * len(vectors)
+        return [
+            QueryRequest(query = vector, filter = to_qdrant(filter_dict), limit = k, with_payload = True) 
+            for vector, filter_dict in zip(vectors, filters)
+        ]
 
-                points.append(point)
 
-                if len(points) >= 100: 
-                    self.qdrant_client.upsert(
-                        collection_name = self.collection_name, 
-                        points = points
-                    )
-                    points = [] 
-            
+    def search_batch(self, vectors: list, k: int, filters: list = None) -> list: 
+
+        responses = self.qdrant_client.query_batch_points(
+            collection_name = self.collection_name,
+            requests = self._requests(vectors, k, filters)
+        )
+
+        return [[(str(point.id), point.score, point.payload) for point in response.points] for response in responses]
+
+
+    def scan(self, batch_size: int = 1000): 
+
+        offset = None 
+        while True: 
+            points, offset = self.qdrant_client.scroll(
+                collection_name = self.collection_name, 
+                limit = batch_size, 
+                offset = offset, 
+                with_payload = True, 
+                with_vectors = False
+            )
             if points: 
-                self.qdrant_client.upsert(
-                    collection_name = self.collection_name, 
-                    points = points
-                )
+                yield [str(point.id) for point in points], [point.payload for point in points]
+            if offset is None: 
+                break 
+
+
+    @property
+    def async_client(self) -> AsyncQdrantClient: 
+
+        if self._async_client is None: 
+            self._async_client = AsyncQdrantClient(url = self.url, api_key = self.api_key)
+
+        return self._async_client
+
+
+    async def asearch_batch(self, vectors: list, k: int, filters: list = None) -> list: 
+
+        # an async in-memory client would be a separate empty store, so that case stays on the sync client
+        if self.url == ":memory:": 
+            return await super().asearch_batch(vectors, k, filters)
+
+        responses = await self.async_client.query_batch_points(
+            collection_name = self.collection_name,
+            requests = self._requests(vectors, k, filters)
+        )
+
+        return [[(str(point.id), point.score, point.payload) for point in response.points] for response in responses]
+
+
+    def health_check(self) -> bool: 
+
+        try : 
+            self.qdrant_client.get_collection(collection_name = self.collection_name)
+            return True 
+
+        except Exception:
+            return False 
+
+
+    def close(self): 
+
+        self.qdrant_client.close()
+
+        if self._async_client is not None: 
+            try : 
+                asyncio.run(self._async_client.close())
+            except RuntimeError: 
+                # called from inside a running loop, the connections are dropped with the process
+                pass 
+            self._async_client = None 
+
+
+
+class LocalBackend(VectorBackend): 
+
+    def __init__(self, index_path: str, dim: int = 768, dtype: str = "float32", use_ann: bool = False, ann_nprobe: int = None, ann_rerank: int = None): 
+
+        self.index = LocalVectorIndex(index_path, dim = dim, dtype = dtype)
+        self.dim = self.index.dim
+        self.ann = None 
+        self._payload_index = None 
+        self._payload_lock = threading.Lock()
+
+        ann_path = os.path.join(index_path, "ivfpq")
+        if use_ann and os.path.exists(os.path.join(ann_path, "meta.json")): 
+            self.ann = IVFPQIndex.load(ann_path, nprobe = ann_nprobe, rerank = ann_rerank)
+
+
+    @property
+    def payload_index(self) -> PayloadIndex: 
+
+        # built from the payload file on the first filtered search, then kept current by upsert
+        if self._payload_index is None: 
+            with self._payload_lock: 
+                if self._payload_index is None: 
+                    payload_index = PayloadIndex()
+                    payload_index.add(range(self.index.count), [self.index.payload(row) for row in range(self.index.count)])
+                    self._payload_index = payload_index
+
+        return self._payload_index
+
+
+    def _search(self, vectors: list, k: int, allowed: np.ndarray = None) -> list: 
+
+        # a filter leaving fewer rows than the probed lists would hold is cheaper, and exact, to scan directly
+        if self.ann is None or (allowed is not None and allowed.sum() <= self.ann.ntotal * self.ann.nprobe / self.ann.nlist): 
+            return self.index.search(vectors, k, allowed = allowed)
+
+        results = self.ann.search(vectors, k, vectors = self.index.vectors, allowed = allowed)
+
+        # rows upserted after the ANN index was built are scanned exactly and merged in
+        if self.index.count > self.ann.ntotal: 
+            tails = self.index.search(vectors, k, start = self.ann.ntotal, allowed = allowed)
+            results = [sorted(hits + tail, key = lambda hit: -hit[1])[:k] for hits, tail in zip(results, tails)]
+
+        return results
+
+
+    def upsert(self, ids: list, vectors: list, payloads: list): 
+
+        self.index.add(ids, vectors, payloads)
+        if self._payload_index is not None: 
+            self._payload_index.add([self.index.rows[str(point_id)] for point_id in ids], payloads)
+
+
+    def _search_filtered(self, vectors: list, k: int, filter_dict: dict = None) -> list: 
+
+        allowed = self.payload_index.mask(filter_dict, self.index.count) if filter_dict else None
+
+        return [
+            [(self.index.ids[row], score, self.index.payload(row)) for row, score in hits]
+            for hits in self._search(vectors, k, allowed)
+        ]
+
+
+    def scan(self, batch_size: int = 1000): 
+
+        for start in range(0, self.index.count, batch_size): 
+            rows = range(start, min(start + batch_size, self.index.count))
+            yield [self.index.ids[row] for row in rows], [self.index.payload(row) for row in rows]
+
+
+    def health_check(self) -> bool: 
+
+        return os.path.exists(self.index.meta_path)
+
+
+    def close(self): 
+
+        self.index.close()
+
+
+
+class MemoryBackend(VectorBackend): 
+
+    def __init__(self, dim: int = 768): 
+
+        self.dim = dim 
+        self.ids = []
+        self.rows = {}
+        self.payloads = []
+        self.count = 0
+        self.vectors = np.zeros((1024, dim), dtype=np.float32)
+        self.payload_index = PayloadIndex()
+        self._lock = threading.Lock()
+
+
+    def upsert(self, ids: list, vectors: list, payloads: list): 
+
+        vectors = LocalVectorIndex.normalize(vectors)
+
+        with self._lock: 
+            for point_id, vector, payload in zip(ids, vectors, payloads): 
+                row = self.rows.get(point_id)
+                if row is None: 
+                    row = self.count
+                    if row == len(self.vectors): 
+                        self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+
+                    self.rows[point_id] = row
+                    self.ids.append(point_id)
+                    self.payloads.append(payload)
+                    self.count += 1
+
+                self.vectors[row] = vector
+                self.payloads[row] = payload
+                self.payload_index.add([row], [payload])
+
+
+    def _search_filtered(self, vectors: list, k: int, filter_dict: dict = None) -> list: 
+
+        rows = np.arange(self.count)
+        if filter_dict: 
+            rows = np.flatnonzero(self.payload_index.mask(filter_dict, self.count))
+
+        count = len(rows)
+        if count == 0: 
+            return [[] for _ in vectors]
+
+        k = min(k, count)
+        matrix = self.vectors[:count] if count == self.count else self.vectors[rows]
+        # one product per query: a batched matmul rounds differently with the batch shape and can flip ties between runs
+        scores = np.stack([matrix @ query for query in LocalVectorIndex.normalize(vectors)])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < count else np.tile(np.arange(count), (len(scores), 1))
+
+        results = []
+        for row_scores, candidates in zip(scores, top): 
+            order = candidates[np.argsort(-row_scores[candidates], kind="stable")]
+            results.append([(self.ids[rows[i]], float(row_scores[i]), self.payloads[rows[i]]) for i in order])
+
+        return results
+
+
+    def scan(self, batch_size: int = 1000): 
+
+        count = self.count
+        for start in range(0, count, batch_size): 
+            yield self.ids[start:min(start + batch_size, count)], self.payloads[start:min(start + batch_size, count)]
+
+
+
+class VectorStore: 
+
+    def __init__(self, collection_name: str = "multi-hop-rag", url: str = None, api_key: str = None, embedding_model = None, embedding_cache_path: str = None, embedding_cache_size: int = 10000, retrieval_cache_size: int = 10000, backend: str = "qdrant", index_path: str = None, index_dtype: str = "float32", use_ann: bool = False, ann_nprobe: int = None, ann_rerank: int = None, retrieval_mode: str = "dense", bm25_path: str = None, rrf_k: int = 60, fusion_candidates: int = 20):
+        if retrieval_mode not in RETRIEVAL_MODES: 
+            raise ValueError(f"Unsupported retrieval mode: {retrieval_mode}. Supported modes are dense, bm25 and hybrid.")
+
+        self.embedding_model = embedding_model if embedding_model is not None else GoogleGenerativeAIEmbeddings(
+            model = "models/text-embedding-004", 
+            google_api_key = os.getenv("GEMINI_API_KEY")
+        )
+
+        self.embedding_cache = EmbeddingCache(
+            model_name = getattr(self.embedding_model, "model", type(self.embedding_model).__name__), 
+            max_entries = embedding_cache_size, 
+            path = embedding_cache_path
+        )
+
+        self.retrieval_cache = RetrievalCache(max_entries = retrieval_cache_size)
+
+        self.collection_name = collection_name
+        self.url = url if url is not None else os.getenv("QDRANT_URL")
+
+        if backend == "qdrant": 
+            self.backend = QdrantBackend(collection_name, url = self.url, api_key = api_key)
+
+        elif backend == "local": 
+            self.backend = LocalBackend(
+                index_path if index_path is not None else os.path.join("indexes", collection_name), 
+                dtype = index_dtype, 
+                use_ann = use_ann, 
+                ann_nprobe = ann_nprobe, 
+                ann_rerank = ann_rerank
+            )
+
+        elif backend == "memory": 
+            self.backend = MemoryBackend(dim = getattr(self.embedding_model, "dim", 768))
+
+        else: 
+            raise ValueError(f"Unsupported vector backend: {backend}. Supported backends are qdrant, local and memory.")
+
+        self.retrieval_mode = retrieval_mode
+        self.rrf_k = rrf_k
+        self.fusion_candidates = fusion_candidates
+        # the in-memory backend has nothing on disk to keep the sparse index next to
+        if bm25_path is None and backend != "memory": 
+            bm25_path = os.path.join(index_path if index_path is not None else os.path.join("indexes", collection_name), "bm25")
+        self.bm25_path = bm25_path
+        self._bm25 = None 
+        self._bm25_lock = threading.Lock()
+
+        self._vector_store = None
+
+
+    @property
+    def qdrant_client(self) -> QdrantClient: 
+
+        if not isinstance(self.backend, QdrantBackend): 
+            raise ValueError("The Qdrant client is only available with the qdrant backend.")
+
+        return self.backend.qdrant_client
+
+
+    @property
+    def vector_store(self) -> QdrantVectorStore: 
+
+        if self._vector_store is None: 
+            self._vector_store = QdrantVectorStore(
+                client = self.qdrant_client, 
+                collection_name = self.collection_name, 
+                embedding = self.embedding_model
+            )
+
+        return self._vector_store
+
+
+    def health_check(self) -> bool: 
+
+        return self.backend.health_check()
+
+
+    @property
+    def bm25(self) -> BM25Index: 
+
+        if self._bm25 is None: 
+            with self._bm25_lock: 
+                if self._bm25 is None: 
+                    if self.bm25_path is not None and os.path.exists(os.path.join(self.bm25_path, "meta.json")): 
+                        self._bm25 = BM25Index.load(self.bm25_path)
+                    else: 
+                        # built once from the payloads already in the collection, then kept in sync by upsert
+                        self._bm25 = BM25Index.build(self.backend.scan())
+                        if self.bm25_path is not None: 
+                            self._bm25.save(self.bm25_path)
+
+        return self._bm25
+
+
+    def close(self): 
+
+        try : 
+            self.embedding_cache.close()
+            if self._bm25 is not None and self._bm25.dirty and self.bm25_path is not None: 
+                self._bm25.save(self.bm25_path)
+            self.backend.close()
+
+        except Exception as e:
+            raise Exception(f"Error closing vector backend: {e}")
+
+
+
+    @property
+    def collection_version(self) -> int: 
+
+        return self.retrieval_cache.version
+
+
+    def upsert(self, ids: list, vectors: list, payloads: list): 
+
+        self.backend.upsert(ids, vectors, payloads)
+        # an index already on disk is kept in sync even while dense mode leaves it unused
+        if self._bm25 is not None or self.retrieval_mode != "dense" or (self.bm25_path is not None and os.path.exists(os.path.join(self.bm25_path, "meta.json"))): 
+            self.bm25.add(ids, payloads)
+        self.retrieval_cache.invalidate()
+
+
+
+    def load_documents_from_json(self, json_path: str, batch_size: int = 100, embed_workers: int = 4, upsert_workers: int = 2, max_in_flight: int = 8, reuse_embeddings: bool = True) -> dict: 
+
+        try : 
+            stats = IngestionPipeline(
+                self, 
+                batch_size = batch_size, 
+                embed_workers = embed_workers, 
+                upsert_workers = upsert_workers, 
+                max_in_flight = max_in_flight, 
+                reuse_embeddings = reuse_embeddings
+            ).run(json_path)
             
-            print(f"Successfully loaded {len(documents)} documents from {json_path} into the vector store.")
+            print(f"Successfully loaded {stats['documents']} documents from {json_path} into the vector store ({stats['docs_per_sec']:.1f} docs/sec).")
+            for stage, stage_stats in stats["stages"].items(): 
+                print(f"  {stage:<8} {stage_stats['docs']:>8} docs  {stage_stats['docs_per_sec']:>10.1f} docs/sec  {stage_stats['docs_per_busy_sec']:>10.1f} docs/busy-sec")
+
+            return stats
 
         except Exception as e:
             raise Exception(f"An error occurred while loading documents: {e}")
 
 
-    def similarity_search(self, query: str, k: int = 5, filter_dict: dict = None):
-        try:
-            
-            query_embedding = self.embedding_model.embed_query(query)
+    def _embed_queries_uncached(self, queries: list) -> list: 
+
+        if len(queries) == 1: 
+            return [self.embedding_model.embed_query(queries[0])]
+
+        if isinstance(self.embedding_model, GoogleGenerativeAIEmbeddings): 
+            return self.embedding_model.embed_documents(queries, task_type = "retrieval_query")
+
+        return self.embedding_model.embed_documents(queries)
+
+
+    def embed_queries(self, queries: list) -> list: 
+
+        return self.embedding_cache.embed(queries, self._embed_queries_uncached)
+
+
+    async def _aembed_queries_uncached(self, queries: list) -> list: 
 
-            search_results = self.qdrant_client.search(
-                collection_name=self.collection_name,
-                query_vector=query_embedding,
-                limit=k
+        # the Gemini client has no native async path, so its task-typed batch call runs on a worker thread
+        if isinstance(self.embedding_model, GoogleGenerativeAIEmbeddings): 
+            return await asyncio.to_thread(self._embed_queries_uncached, queries)
+
+        if len(queries) == 1: 
+            return [await self.embedding_model.aembed_query(queries[0])]
+
+        return await self.embedding_model.aembed_documents(queries)
+
+
+    async def aembed_queries(self, queries: list) -> list: 
+
+        return await self.embedding_cache.aembed(queries, self._aembed_queries_uncached)
+
+
+    def _to_documents(self, results: list) -> list: 
+
+        documents = []
+        for point_id, score, payload in results:
+
+            doc = Document(
+                page_content=f"{payload.get('title', '')}\n{payload.get('passage', '')}",
+                metadata={
+                    'id': point_id,
+                    'title': payload.get('title', ''),
+                    'passage': payload.get('passage', ''),
+                    'source': payload.get('source'),
+                    'published_at': payload.get('published_at'),
+                    'score': score  
+                }
             )
+            documents.append(doc)
+        
+        return documents 
+
+
+    def similarity_search(self, query: str, k: int = 5, filter_dict: dict = None, mode: str = None, embedding: list = None):
+        try:
             
-            documents = []
-            for result in search_results:
-    
-                doc = Document(
-                    page_content=f"{result.payload.get('title', '')}\n{result.payload.get('passage', '')}",
-                    metadata={
-                        'title': result.payload.get('title', ''),
-                        'passage': result.payload.get('passage', ''),
-                        'score': result.score  
-                    }
-                )
-                documents.append(doc)
-            
-            return documents  
+            return self.batch_similarity_search([query], k = k, filter_dict = filter_dict, mode = mode, embeddings = [embedding] if embedding is not None else None)[0]
         except Exception as e:
             raise Exception(f"Error during similarity search: {e}")
 
 
+    def _lookup_cached(self, query_embeddings: list, k: int, filters: list) -> tuple: 
+
+        # the filter is part of the key scope, so a filtered top-k never answers an unfiltered query or another filter
+        version = self.retrieval_cache.version
+        keys = [RetrievalCache.make_key(query_embedding, filter_key(filter_dict)) for query_embedding, filter_dict in zip(query_embeddings, filters)]
+        results = [self.retrieval_cache.get(key, k) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+
+        return keys, results, missing, version
+
+
+    def _fill_cached(self, keys: list, results: list, missing: list, responses: list, k: int, version: int) -> list: 
+
+        for i, response in zip(missing, responses): 
+            results[i] = response
+            self.retrieval_cache.put(keys[i], k, results[i], version)
+
+        return results
+
+
+    def _resolve_mode(self, mode: str) -> str: 
+
+        mode = mode if mode is not None else self.retrieval_mode
+        if mode not in RETRIEVAL_MODES: 
+            raise ValueError(f"Unsupported retrieval mode: {mode}. Supported modes are dense, bm25 and hybrid.")
+
+        return mode
+
+
+    @staticmethod
+    def _resolve_filters(queries: list, filter_dict: dict, filters: list) -> list: 
+
+        if filters is None: 
+            filters = [filter_dict] * len(queries)
+
+        if len(filters) != len(queries): 
+            raise ValueError(f"Expected one filter per query, got {len(filters)} filters for {len(queries)} queries.")
+
+        return [normalize_filter(filter_dict) for filter_dict in filters]
+
+
+    def _search_backend(self, vectors: list, k: int, filters: list) -> list: 
+
+        return self.backend.search_batch(vectors, k, filters = filters)
+
+
+    async def _asearch_backend(self, vectors: list, k: int, filters: list) -> list: 
+
+        return await self.backend.asearch_batch(vectors, k, filters = filters)
+
+
+    def _bm25_search(self, queries: list, k: int, filters: list) -> list: 
+
+        with span("bm25"): 
+            return self.bm25.search(queries, k, filters = filters)
+
+
+    def _fuse(self, queries: list, dense_results: list, k: int, depth: int, filters: list) -> list: 
+
+        sparse_results = self._bm25_search(queries, depth, filters)
+
+        return [
+            reciprocal_rank_fusion([dense, sparse], k, rrf_k = self.rrf_k) 
+            for dense, sparse in zip(dense_results, sparse_results)
+        ]
+
+
+    def _retrieve(self, queries: list, k: int, filters: list, mode: str, embeddings: list = None) -> list: 
+
+        if mode == "bm25": 
+            return self._bm25_search(queries, k, filters)
+
+        # hybrid fuses deeper lists than it returns, so documents ranked just below k by one side can still surface
+        depth = k if mode == "dense" else max(k, self.fusion_candidates)
+        # callers that already embedded the queries pass the vectors in, so they are not looked up twice
+        query_embeddings = embeddings
+        if query_embeddings is None: 
+            with span("embed"): 
+                query_embeddings = self.embed_queries(queries)
+
+        keys, results, missing, version = self._lookup_cached(query_embeddings, depth, filters)
+        annotate(cache_hits = len(queries) - len(missing))
+
+        responses = []
+        if missing: 
+            with span("search"): 
+                responses = self._search_backend([query_embeddings[i] for i in missing], depth, [filters[i] for i in missing])
+
+        results = self._fill_cached(keys, results, missing, responses, depth, version)
+        if mode == "hybrid": 
+            results = self._fuse(queries, results, k, depth, filters)
+
+        return results
+
+
+    async def _aretrieve(self, queries: list, k: int, filters: list, mode: str, embeddings: list = None) -> list: 
+
+        # BM25 scoring is in-process numpy work, short enough to run on the loop
+        if mode == "bm25": 
+            return self._bm25_search(queries, k, filters)
+
+        depth = k if mode == "dense" else max(k, self.fusion_candidates)
+        # callers that already embedded the queries pass the vectors in, so they are not looked up twice
+        query_embeddings = embeddings
+        if query_embeddings is None: 
+            with span("embed"): 
+                query_embeddings = await self.aembed_queries(queries)
+
+        keys, results, missing, version = self._lookup_cached(query_embeddings, depth, filters)
+        annotate(cache_hits = len(queries) - len(missing))
+
+        responses = []
+        if missing: 
+            with span("search"): 
+                responses = await self._asearch_backend([query_embeddings[i] for i in missing], depth, [filters[i] for i in missing])
+
+        results = self._fill_cached(keys, results, missing, responses, depth, version)
+        if mode == "hybrid": 
+            results = self._fuse(queries, results, k, depth, filters)
+
+        return results
+
+
+    @staticmethod
+    def _relaxed(filters: list, results: list) -> list: 
+
+        # a filter naming a source or date the corpus does not have would leave the sub-query without evidence
+        return [i for i, (filter_dict, result) in enumerate(zip(filters, results)) if filter_dict and not result]
+
+
+    def batch_similarity_search(self, queries: list, k: int = 5, filter_dict: dict = None, mode: str = None, filters: list = None, embeddings: list = None) -> list:
+        try:
+            if not queries: 
+                return []
+
+            mode = self._resolve_mode(mode)
+            filters = VectorStore._resolve_filters(queries, filter_dict, filters)
+            with span("retrieval"): 
+                results = self._retrieve(queries, k, filters, mode, embeddings)
+
+                relaxed = VectorStore._relaxed(filters, results)
+                if relaxed: 
+                    # recorded in the trace, so a filter that never matches (e.g. a misspelt source) shows up
+                    annotate(relaxed_filters = len(relaxed))
+                    for i, result in zip(relaxed, self._retrieve([queries[i] for i in relaxed], k, [None] * len(relaxed), mode, [embeddings[i] for i in relaxed] if embeddings is not None else None)): 
+                        results[i] = result
+
+                return [self._to_documents(result) for result in results]
+        except Exception as e:
+            raise Exception(f"Error during batch similarity search: {e}")
+
+
+    async def abatch_similarity_search(self, queries: list, k: int = 5, filter_dict: dict = None, mode: str = None, filters: list = None, embeddings: list = None) -> list:
+        try:
+            if not queries: 
+                return []
+
+            mode = self._resolve_mode(mode)
+            filters = VectorStore._resolve_filters(queries, filter_dict, filters)
+            with span("retrieval"): 
+                results = await self._aretrieve(queries, k, filters, mode, embeddings)
+
+                relaxed = VectorStore._relaxed(filters, results)
+                if relaxed: 
+                    # recorded in the trace, so a filter that never matches (e.g. a misspelt source) shows up
+                    annotate(relaxed_filters = len(relaxed))
+                    for i, result in zip(relaxed, await self._aretrieve([queries[i] for i in relaxed], k, [None] * len(relaxed), mode, [embeddings[i] for i in relaxed] if embeddings is not None else None)): 
+                        results[i] = result
+
+                return [self._to_documents(result) for result in results]
+        except Exception as e:
+            raise Exception(f"Error during async batch similarity search: {e}")
+
+
+
+class VectorStorePool: 
+
+    _instances = {}
+    _last_checked = {}
+    _key_locks = {}
+    _defaults = {}
+    _lock = threading.Lock()
+
+    health_check_interval = 60.0
+
+
+    @classmethod
+    def configure(cls, **defaults): 
+
+        with cls._lock: 
+            cls._defaults.update(defaults)
+
+
+    @classmethod
+    def _key(cls, collection_name: str, url: str, options: dict) -> tuple: 
+
+        if options.get("backend", "qdrant") == "local": 
+            return (collection_name, f"local:{options.get('index_path') or os.path.join('indexes', collection_name)}")
+
+        if options.get("backend", "qdrant") == "memory": 
+            return (collection_name, "memory")
+
+        return (collection_name, url if url is not None else os.getenv("QDRANT_URL"))
+
+
+    @classmethod
+    def get(cls, collection_name: str = "multi-hop-rag", url: str = None, api_key: str = None, embedding_model = None, **kwargs) -> VectorStore: 
+
+        options = {**cls._defaults, **kwargs}
+        embedding_model = embedding_model if embedding_model is not None else options.pop("embedding_model", None)
+        options.pop("embedding_model", None)
+        key = cls._key(collection_name, url, options)
+
+        with cls._lock: 
+            store = cls._instances.get(key)
+            now = time.monotonic()
+
+            # one caller per interval runs the check, the others keep using the store meanwhile
+            check = store is not None and now - cls._last_checked[key] > cls.health_check_interval
+            if check: 
+                cls._last_checked[key] = now
+            key_lock = cls._key_locks.setdefault(key, threading.Lock())
+
+        # network calls (the health check, connecting a new client) run outside the pool lock
+        stale = None
+        if check and not store.health_check(): 
+            stale, store = store, None
+
+        if store is None: 
+            with key_lock: 
+                with cls._lock: 
+                    current = cls._instances.get(key)
+                if current is not None and current is not stale: 
+                    return current
+
+                store = VectorStore(
+                    collection_name = collection_name, 
+                    url = url, 
+                    api_key = api_key, 
+                    embedding_model = embedding_model, 
+                    **options
+                )
+
+                # the failed store is swapped out but not closed: other callers may still be searching on it, GC releases it
+                with cls._lock: 
+                    cls._instances[key] = store 
+                    cls._last_checked[key] = time.monotonic()
+
+        return store
+
+
+    @classmethod
+    async def aget(cls, *args, **kwargs) -> VectorStore: 
+
+        # the health check and client construction block, so they run off the event loop
+        return await asyncio.to_thread(cls.get, *args, **kwargs)
+
+
+    @classmethod
+    def close(cls, collection_name: str = "multi-hop-rag", url: str = None, **kwargs): 
+
+        with cls._lock: 
+            cls._discard(cls._key(collection_name, url, {**cls._defaults, **kwargs}))
+
+
+    @classmethod
+    def close_all(cls): 
+
+        with cls._lock: 
+            for key in list(cls._instances.keys()): 
+                cls._discard(key)
+
+
+    @classmethod
+    def _discard(cls, key: tuple): 
+
+        store = cls._instances.pop(key, None)
+        cls._last_checked.pop(key, None)
+
+        if store is not None: 
+            try : 
+                store.close()
+            except Exception: 
+                pass 
+
+
+atexit.register(VectorStorePool.close_all)
+
+
 if __name__ == "__main__": 
 
     vector_store = VectorStore()